@@ -0,0 +1,183 @@
+# MIT APasz
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+
+import metrics
+import util
+
+log = logging.getLogger("TSlog")
+
+chunkSize = 1024 * 1024
+# Objects newer than this (seconds) are never collected, they may belong to a store in progress
+gcGrace = 3600
+lock = threading.Lock()
+
+
+def object_path(archiveDir: str, digest: str) -> str:
+    """Returns path of the blob with digest"""
+    return os.path.join(archiveDir, "objects", digest[:2], digest[2:])
+
+
+def manifest_dir(archiveDir: str) -> str:
+    """Returns folder the manifests are kept in"""
+    return os.path.join(archiveDir, "manifests")
+
+
+def store_blob(archiveDir: str, itemPath: str) -> str:
+    """Stores the compressed content of a file if not already stored. Returns its digest"""
+    hasher = hashlib.sha256()
+    with open(itemPath, "rb") as file:
+        while chunk := file.read(chunkSize):
+            hasher.update(chunk)
+    digest = hasher.hexdigest()
+    blobPath = object_path(archiveDir=archiveDir, digest=digest)
+    if os.path.exists(blobPath):
+        return digest
+    os.makedirs(os.path.dirname(blobPath), exist_ok=True)
+    tmpPath = f"{blobPath}.{threading.get_ident()}.tmp"
+    compressor = zlib.compressobj()
+    with open(itemPath, "rb") as src, open(tmpPath, "wb") as dst:
+        while chunk := src.read(chunkSize):
+            dst.write(compressor.compress(chunk))
+        dst.write(compressor.flush())
+    os.replace(tmpPath, blobPath)
+    return digest
+
+
+def store(archiveDir: str, source: str, name: str) -> str | None:
+    """Archives the folder source under name. Returns the manifest path"""
+    log.debug(f"run| {name=}| {source=}")
+    manifest = {
+        "name": name,
+        "created": time.time(),
+        "dirs": [],
+        "files": {},
+        "links": {},
+    }
+    with lock, metrics.span("store", "archive", name=name):
+        try:
+            for root, dirs, files in os.walk(source):
+                relRoot = os.path.relpath(root, source)
+                for item in dirs:
+                    relPath = os.path.normpath(os.path.join(relRoot, item))
+                    if os.path.islink(os.path.join(root, item)):
+                        manifest["links"][relPath] = os.readlink(
+                            os.path.join(root, item)
+                        )
+                    else:
+                        manifest["dirs"].append(relPath)
+                for item in files:
+                    itemPath = os.path.join(root, item)
+                    relPath = os.path.normpath(os.path.join(relRoot, item))
+                    if os.path.islink(itemPath):
+                        manifest["links"][relPath] = os.readlink(itemPath)
+                        continue
+                    stat = os.stat(itemPath)
+                    manifest["files"][relPath] = {
+                        "hash": store_blob(archiveDir=archiveDir, itemPath=itemPath),
+                        "size": stat.st_size,
+                        "mode": stat.st_mode & 0o777,
+                        "mtime": stat.st_mtime,
+                    }
+            os.makedirs(manifest_dir(archiveDir), exist_ok=True)
+            manPath = os.path.join(manifest_dir(archiveDir), f"{name}.json")
+            while os.path.exists(manPath):
+                manPath = os.path.join(
+                    manifest_dir(archiveDir),
+                    util.same_name(item=os.path.basename(manPath), isFile=True),
+                )
+            manifest["name"] = os.path.basename(manPath).removesuffix(".json")
+            with open(manPath + ".tmp", "w") as file:
+                json.dump(manifest, file, indent=4)
+            os.replace(manPath + ".tmp", manPath)
+        except Exception:
+            log.exception("Archive Store")
+            return None
+    log.info(f"Archived {len(manifest['files'])} files| {manPath=}")
+    return manPath
+
+
+def listing(archiveDir: str) -> list[dict]:
+    """Returns manifests of every archived version, oldest first"""
+    manifests = []
+    if not os.path.isdir(manifest_dir(archiveDir)):
+        return manifests
+    for entry in os.scandir(manifest_dir(archiveDir)):
+        if not entry.name.endswith(".json"):
+            continue
+        try:
+            with open(entry.path, "r") as file:
+                manifest = json.load(file)
+        except Exception:
+            log.exception(f"Archive Manifest Load {entry.name=}")
+            continue
+        manifest["path"] = entry.path
+        manifests.append(manifest)
+    return sorted(manifests, key=lambda manifest: manifest["created"])
+
+
+def restore(archiveDir: str, manifest: dict, destination: str) -> bool:
+    """Recreates an archived version at destination"""
+    log.debug(f"run| {manifest['name']=}| {destination=}")
+    try:
+        for relPath in manifest["dirs"]:
+            os.makedirs(os.path.join(destination, relPath), exist_ok=True)
+        for relPath, entry in manifest["files"].items():
+            itemPath = os.path.join(destination, relPath)
+            os.makedirs(os.path.dirname(itemPath), exist_ok=True)
+            decompressor = zlib.decompressobj()
+            blobPath = object_path(archiveDir=archiveDir, digest=entry["hash"])
+            with open(blobPath, "rb") as src, open(itemPath, "wb") as dst:
+                while chunk := src.read(chunkSize):
+                    dst.write(decompressor.decompress(chunk))
+                dst.write(decompressor.flush())
+            os.chmod(itemPath, entry["mode"])
+            os.utime(itemPath, (entry["mtime"], entry["mtime"]))
+        for relPath, linkTo in manifest["links"].items():
+            os.symlink(linkTo, os.path.join(destination, relPath))
+    except Exception:
+        log.exception("Archive Restore")
+        return False
+    log.info(f"Restored {manifest['name']}| {destination=}")
+    return True
+
+
+def prune(archiveDir: str, keep: int, maxAge: float) -> int:
+    """Removes manifests beyond the newest keep, or older than maxAge days.
+    The newest is always kept. Returns number removed"""
+    manifests = listing(archiveDir)[:-1]
+    cutoff = time.time() - (maxAge * 86400)
+    removed = 0
+    for index, manifest in enumerate(reversed(manifests), start=1):
+        if index < keep and manifest["created"] >= cutoff:
+            continue
+        if util.remove_thing(itemPath=manifest["path"], isFile=True):
+            removed += 1
+    return removed
+
+
+def collect_garbage(archiveDir: str) -> int:
+    """Removes blobs no manifest refers to. Returns number removed"""
+    objDir = os.path.join(archiveDir, "objects")
+    if not os.path.isdir(objDir):
+        return 0
+    removed = 0
+    with lock:
+        used = set()
+        for manifest in listing(archiveDir):
+            used.update(entry["hash"] for entry in manifest["files"].values())
+        cutoff = time.time() - gcGrace
+        for fanout in os.scandir(objDir):
+            for entry in os.scandir(fanout.path):
+                if fanout.name + entry.name in used:
+                    continue
+                if entry.stat().st_mtime > cutoff:
+                    continue
+                os.remove(entry.path)
+                removed += 1
+    return removed
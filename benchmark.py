@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# MIT APasz
+"""Times the deploy and launch path against a generated local repository and local
+listeners, so it runs without network access. Results are written as JSON"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+log = logging.getLogger("TSlog")
+
+gitEnv = {
+    "GIT_AUTHOR_NAME": "bench",
+    "GIT_AUTHOR_EMAIL": "bench@localhost",
+    "GIT_COMMITTER_NAME": "bench",
+    "GIT_COMMITTER_EMAIL": "bench@localhost",
+}
+botScript = "import sys\nsys.exit(0)\n"
+
+
+def git(repoPath: str, *args: str):
+    subprocess.run(
+        ["git", *args],
+        cwd=repoPath,
+        env=os.environ | gitEnv,
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def write_files(repoPath: str, names: list[str], size: int):
+    for name in names:
+        itemPath = os.path.join(repoPath, name)
+        os.makedirs(os.path.dirname(itemPath), exist_ok=True)
+        with open(itemPath, "wb") as file:
+            file.write(os.urandom(size))
+
+
+def file_names(count: int) -> list[str]:
+    """Spreads count files over folders of 100"""
+    return [f"data/{index // 100}/{index}.bin" for index in range(count)]
+
+
+def make_repo(repoPath: str, files: int, size: int, history: int):
+    """Creates a repository of files of size bytes, with history commits each
+    changing a tenth of them"""
+    os.makedirs(repoPath)
+    git(repoPath, "init", "-q")
+    names = file_names(files)
+    write_files(repoPath, names, size)
+    with open(os.path.join(repoPath, "bot.py"), "w") as file:
+        file.write(botScript)
+    git(repoPath, "add", "-A")
+    git(repoPath, "commit", "-q", "-m", "initial")
+    for _ in range(history - 1):
+        add_commit(repoPath, names, size)
+
+
+def add_commit(repoPath: str, names: list[str], size: int):
+    changed = random.sample(names, max(1, len(names) // 10)) if names else []
+    write_files(repoPath, changed, size)
+    with open(os.path.join(repoPath, "bot.py"), "a") as file:
+        file.write("# bump\n")
+    git(repoPath, "commit", "-q", "-am", "update")
+
+
+def listeners(count: int) -> list[socket.socket]:
+    """Opens count local TCP listeners. Connections complete from the backlog unaccepted"""
+    return [socket.create_server(("127.0.0.1", 0), backlog=128) for _ in range(count)]
+
+
+def write_config(
+    folder: str, repoPath: str, required: int, hosts: list[socket.socket]
+) -> str:
+    itemPath = os.path.join(folder, "triggerConfig.json")
+    data = {
+        "core": {
+            "logLevel": "WARNING",
+            "gateway": "127.0.0.1",
+            "network": {},
+            "checkRequiredPackages": False,
+            "metricsDirectory": None,
+            "probeCacheTTL": 0,
+            "fastStartMaxAge": 0,
+        },
+        "targets": [
+            {
+                "repository": repoPath,
+                "scriptName": "bot.py",
+                "requiredModules": False,
+                "requiredFiles": [f"required/{index}.cfg" for index in range(required)],
+                "network": {
+                    f"host{index}": f"127.0.0.1:{sock.getsockname()[1]}"
+                    for index, sock in enumerate(hosts)
+                },
+                "checkVersion": False,
+                "restartPolicy": "never",
+                "outputDirectory": None,
+                "sampleInterval": 0,
+            }
+        ],
+    }
+    with open(itemPath, "w") as file:
+        json.dump(data, file, indent=4)
+    return itemPath
+
+
+def timed(results: dict, name: str, func, *args, **kwargs):
+    st = time.perf_counter()
+    value = func(*args, **kwargs)
+    results.setdefault(name, []).append(time.perf_counter() - st)
+    return value
+
+
+def summary(runs: list[float]) -> dict:
+    return {
+        "runs": [round(run, 6) for run in runs],
+        "min": round(min(runs), 6),
+        "median": round(statistics.median(runs), 6),
+        "mean": round(statistics.fmean(runs), 6),
+    }
+
+
+def run(args: argparse.Namespace, folder: str) -> dict:
+    """Deploys and launches the target args.repeat times. Returns {step: [seconds]}"""
+    repoPath = os.path.join(folder, "upstream")
+    make_repo(repoPath, files=args.files, size=args.size, history=args.history)
+    hosts = listeners(args.hosts)
+    configPath = write_config(folder, repoPath, args.required, hosts)
+
+    import metrics
+    import release
+    import triggerScript as ts
+
+    # Everything triggerScript keeps beside itself goes in folder instead
+    ts.curDir = folder
+    if not ts.setup(itemPath=configPath):
+        raise RuntimeError("Benchmark Config Invalid")
+    # stdout is kept for the results
+    ts.handleConsole.setStream(sys.stderr)
+    targetCF = ts.targetsCF[0]
+    tarDir, _, _ = ts.targetDirs(targetCF)
+    results = {}
+
+    first = timed(results, "gitCloneCold", ts.gitClone, targetCF, {})
+    release.activate(activePath=tarDir, releasePath=first)
+    write_files(tarDir, targetCF.requiredFiles, args.requiredSize)
+    names = file_names(args.files)
+    for _ in range(args.repeat):
+        add_commit(repoPath, names, args.size)
+        st = time.perf_counter()
+        newRelease = timed(results, "gitClone", ts.gitClone, targetCF, {})
+        for item in targetCF.requiredFiles:
+            timed(
+                results,
+                "copyRequired",
+                ts.copyRequired,
+                item=item,
+                isFile=True,
+                tarDir=tarDir,
+                releasePath=newRelease,
+                hardlink=targetCF.hardlinkRequired,
+            )
+        oldRelease = release.current(tarDir)
+        release.activate(activePath=tarDir, releasePath=newRelease)
+        results.setdefault("deploy", []).append(time.perf_counter() - st)
+        timed(results, "archive", ts.archiveRelease, targetCF, oldRelease)
+        ts.netResults.clear()
+        timed(results, "networkChecks", ts.networkChecks, core=False, targetCF=targetCF)
+        # Only until the target's process exists, not it running to exit and teardown
+        ts.launch()
+        spawned = [
+            item["duration"]
+            for item in metrics.spans
+            if (item["cat"], item["name"]) == ("target", "spawn")
+        ]
+        results.setdefault("launch", []).append(spawned[-1])
+    for sock in hosts:
+        sock.close()
+    # copyRequired is timed per file, report it per deploy
+    perFile = results.pop("copyRequired", [])
+    if perFile:
+        count = len(targetCF.requiredFiles)
+        results["copyRequired"] = [
+            sum(perFile[index : index + count])
+            for index in range(0, len(perFile), count)
+        ]
+    return results
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=500, help="files in the repo")
+    parser.add_argument("--size", type=int, default=4096, help="bytes per file")
+    parser.add_argument("--history", type=int, default=10, help="commits in the repo")
+    parser.add_argument("--required", type=int, default=20, help="required files")
+    parser.add_argument(
+        "--requiredSize", type=int, default=65536, help="bytes per required file"
+    )
+    parser.add_argument("--hosts", type=int, default=5, help="network targets")
+    parser.add_argument("--repeat", type=int, default=5, help="deploys to time")
+    parser.add_argument("--output", help="file to write JSON to, default stdout")
+    args = parser.parse_args(argv)
+    with tempfile.TemporaryDirectory(prefix="tsbench-") as folder:
+        results = run(args, folder)
+    report = {
+        "created": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": vars(args),
+        "results": {name: summary(runs) for name, runs in results.items()},
+    }
+    output = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
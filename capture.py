@@ -0,0 +1,171 @@
+# MIT APasz
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+import logqueue
+import metrics
+
+log = logging.getLogger("TSlog")
+
+chunkSize = 64 * 1024
+# Characters of output waiting to be written per target, beyond which it's dropped rather
+# than held
+maxQueued = 16 * 1024 * 1024
+
+
+class Ring:
+    """Keeps only the last size bytes written to it, nothing if size is 0"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.chunks = deque()
+        self.length = 0
+
+    def write(self, data: bytes):
+        if self.size <= 0:
+            return
+        if len(data) >= self.size:
+            self.chunks.clear()
+            self.chunks.append(data[-self.size :])
+            self.length = len(self.chunks[0])
+            return
+        self.chunks.append(data)
+        self.length += len(data)
+        while self.length > self.size:
+            extra = self.length - self.size
+            if len(self.chunks[0]) <= extra:
+                self.length -= len(self.chunks.popleft())
+            else:
+                self.chunks[0] = self.chunks[0][extra:]
+                self.length -= extra
+
+    def getvalue(self) -> bytes:
+        return b"".join(self.chunks)
+
+
+class LineFormatter(logging.Formatter):
+    """Prefixes every line of a record, so one record can carry a whole chunk of output"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        record.asctime = self.formatTime(record)
+        prefix = f"{record.asctime[:19]} | {record.pid} {record.stream} |:| "
+        return prefix + f"\n{prefix}".join(record.getMessage().split("\n"))
+
+
+def target_logger(
+    name: str, folder: str, maxBytes: int, backupCount: int, maxAge: float
+) -> logging.Logger:
+    """Returns the logger a target's output is written to, <folder>/<name>.log"""
+    logger = logging.getLogger(f"TSout.{name}")
+    if logger.handlers:
+        return logger
+    os.makedirs(folder, exist_ok=True)
+    handler = logqueue.CompressingFileHandler(
+        filename=os.path.join(folder, f"{name}.log"),
+        maxBytes=maxBytes,
+        backupCount=backupCount,
+        maxAge=maxAge,
+    )
+    handler.setFormatter(LineFormatter())
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logqueue.start(log=logger, handlers=[handler], maxLength=maxQueued)
+    return logger
+
+
+class Capture:
+    """Streams a process's stdout/stderr into a target's log, keeping the tail in a Ring"""
+
+    def __init__(self, name: str, logger: logging.Logger, folder: str, bufferSize: int):
+        self.name = name
+        self.logger = logger
+        self.folder = folder
+        self.ring = Ring(bufferSize)
+        self.tasks = []
+        # {marker: set once it's been written to stdout}
+        self.markers = {}
+
+    def watch(self, marker: str) -> asyncio.Event:
+        """Returns an event set once marker is written to stdout. Call before start"""
+        return self.markers.setdefault(marker.encode(), asyncio.Event())
+
+    def start(self, proc: asyncio.subprocess.Process):
+        """Starts reading the process's pipes"""
+        loop = asyncio.get_running_loop()
+        for label, stream in (("out", proc.stdout), ("err", proc.stderr)):
+            if stream is not None:
+                self.tasks.append(loop.create_task(self.pump(stream, label, proc.pid)))
+
+    async def pump(self, stream: asyncio.StreamReader, label: str, pid: int):
+        """Logs the lines read from stream until it closes, a record per read"""
+        extra = {"pid": pid, "stream": label}
+        partial = b""
+        tail = b""
+        while chunk := await stream.read(chunkSize):
+            self.ring.write(chunk)
+            if label == "out" and self.markers:
+                self.find_markers(tail + chunk)
+                tail = chunk[-self.longest :]
+            metrics.add("target_output_bytes_total", len(chunk), target=self.name)
+            lines = (partial + chunk).split(b"\n")
+            partial = lines.pop()
+            # A line that never ends is logged in pieces rather than held onto
+            if len(partial) >= chunkSize:
+                lines.append(partial)
+                partial = b""
+            if lines:
+                text = b"\n".join(lines).decode(errors="replace")
+                self.logger.info(text.replace("\r\n", "\n"), extra=extra)
+        if partial:
+            self.logger.info(partial.decode(errors="replace"), extra=extra)
+
+    @property
+    def longest(self) -> int:
+        """Bytes kept between reads, so a marker split across them is still found"""
+        return max(map(len, self.markers), default=0)
+
+    def find_markers(self, data: bytes):
+        for marker, event in self.markers.items():
+            if not event.is_set() and marker in data:
+                event.set()
+
+    async def finish(self, timeout: float = 5):
+        """Waits for the pipes to be drained. Gives up after timeout, as a child
+        the process left running may hold them open"""
+        if not self.tasks:
+            return
+        _, pending = await asyncio.wait(self.tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        for handler in self.logger.handlers:
+            dropped = getattr(handler, "dropped", 0)
+            if dropped:
+                handler.dropped = 0
+                metrics.add("target_output_dropped_total", dropped, target=self.name)
+                log.warning(
+                    f"{self.name} Output Too Fast To Log, {dropped} Lines Dropped"
+                )
+
+    def report(
+        self, pid: int, returncode: int | None, uptime: float, wd: str
+    ) -> str | None:
+        """Writes a crash report ending with the tail of the output. Returns its path"""
+        stamp = time.strftime("%Y-%m-%d_%H-%M-%S")
+        itemPath = os.path.join(self.folder, f"{self.name}-crash-{stamp}-{pid}.log")
+        header = (
+            f"Target: {self.name}\nPID: {pid}\nReturn Code: {returncode}\n"
+            f"Uptime: {uptime:.1f}s\nDirectory: {wd}\n"
+            f"--- Last {self.ring.length} bytes of output ---\n"
+        )
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            with open(itemPath, "wb") as file:
+                file.write(header.encode())
+                file.write(self.ring.getvalue())
+        except Exception:
+            log.exception("Crash Report")
+            return None
+        return itemPath
@@ -0,0 +1,268 @@
+# MIT APasz
+import json
+import logging
+import os
+import types
+from collections.abc import Callable
+from dataclasses import fields
+
+import resources
+from triggerConfig import CORE, TARGET
+
+log = logging.getLogger("TSlog")
+
+# Kept here rather than beside their users, so validating doesn't import asyncio
+# always: restart whenever it exits | failure: restart on restartCode or any non-zero code
+# restartCode: only restart on restartCode | never: don't restart
+restartPolicies = ("always", "failure", "restartCode", "never")
+# tcp: "host:port" accepts a connection | file: path (from the working directory) exists
+# stdout: marker written to stdout | http: URL answers with a 2xx/3xx status
+readinessKinds = ("tcp", "file", "stdout", "http")
+# Looked for beside triggerConfig.py, first found is used
+fileNames = ("triggerConfig.toml", "triggerConfig.json")
+# Target settings applied to a running target at once, the rest wait until it next starts
+targetLive = {
+    "network",
+    "resourceLimits",
+    "resourceWindow",
+    "sampleInterval",
+    "stableUptime",
+    "restartBackoffMax",
+    "rollbackAfter",
+}
+# Core settings only applied when this script next starts, the rest apply at once
+coreRestart = {
+    "requiredModules",
+    "gitHub",
+    "checkRequiredPackages",
+    "launchTarget",
+    "mirrorDirectory",
+    "metricsDirectory",
+    "webhookAddress",
+    "webhookSecret",
+}
+
+
+def find(folder: str) -> str | None:
+    """Returns path of the config file in folder, None if there isn't one"""
+    for name in fileNames:
+        itemPath = os.path.join(folder, name)
+        if os.path.isfile(itemPath):
+            return itemPath
+    return None
+
+
+def matches(value, hint) -> bool:
+    """Whether value is of the annotated type hint, written as in triggerConfig.py"""
+    origin = getattr(hint, "__origin__", None)
+    args = getattr(hint, "__args__", ())
+    if isinstance(hint, types.UnionType):
+        return any(matches(value, arg) for arg in args)
+    if hint is type(None):
+        return value is None
+    if origin is list:
+        return isinstance(value, list) and all(matches(item, args[0]) for item in value)
+    if origin is dict:
+        return isinstance(value, dict) and all(
+            matches(key, args[0]) and matches(val, args[1])
+            for key, val in value.items()
+        )
+    if hint is float:
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    if hint is int:
+        return isinstance(value, int) and not isinstance(value, bool)
+    return isinstance(value, hint)
+
+
+def type_problems(item, where: str) -> dict[str, str]:
+    """Returns {field: problem} for each field of a config dataclass holding the wrong type"""
+    problems = {}
+    for entry in fields(item):
+        value = getattr(item, entry.name)
+        if not matches(value, entry.type):
+            problems[entry.name] = f"{where}.{entry.name}: {value!r} isn't {entry.type}"
+    return problems
+
+
+def validate(core: CORE, targets: list[TARGET]) -> list[str]:
+    """Returns everything wrong with a config, empty if it's usable. Every problem is
+    found in one pass, checks of a field holding the wrong type are skipped"""
+    mistyped = type_problems(core, "core")
+    problems = list(mistyped.values())
+    if "logLevel" not in mistyped and not isinstance(
+        logging.getLevelName(core.logLevel.upper()), int
+    ):
+        problems.append(f"core.logLevel: unknown level {core.logLevel!r}")
+    for name in (
+        "pollInterval",
+        "pollBackoffMax",
+        "webhookDebounce",
+        "paceErr",
+        "fastStartMaxAge",
+        "probeCacheTTL",
+    ):
+        if name not in mistyped and getattr(core, name) < 0:
+            problems.append(f"core.{name}: can't be negative")
+    webhookPort = str(core.webhookAddress).rpartition(":")[2]
+    if core.webhookAddress is not None and not webhookPort.isdigit():
+        problems.append(f"core.webhookAddress: {core.webhookAddress!r} has no port")
+    if not targets:
+        problems.append("targets: at least one is needed")
+    for attr in ("targetDirectory", "releaseDirectory", "archiveDirectory"):
+        folders = [str(getattr(targetCF, attr)) for targetCF in targets]
+        if len(folders) != len(set(folders)):
+            problems.append(f"targets: each needs its own {attr}, {folders=}")
+    for index, targetCF in enumerate(targets):
+        where = f"targets[{index}]"
+        mistyped = type_problems(targetCF, where)
+        problems += mistyped.values()
+        if (
+            "restartPolicy" not in mistyped
+            and targetCF.restartPolicy not in restartPolicies
+        ):
+            problems.append(
+                f"{where}.restartPolicy: unknown {targetCF.restartPolicy!r}"
+            )
+        if "resourceLimits" not in mistyped:
+            for name in targetCF.resourceLimits:
+                if name not in resources.thresholdUnits:
+                    problems.append(f"{where}.resourceLimits: unknown {name!r}")
+        if "rlimits" not in mistyped:
+            for name in targetCF.rlimits:
+                if not resources.rlimit_known(name):
+                    problems.append(f"{where}.rlimits: unknown {name!r}")
+        if "readiness" not in mistyped:
+            for kind, value in targetCF.readiness.items():
+                if kind not in readinessKinds:
+                    problems.append(f"{where}.readiness: unknown {kind!r}")
+                elif kind == "tcp" and not value.rpartition(":")[2].isdigit():
+                    problems.append(f"{where}.readiness: tcp {value!r} has no port")
+                elif kind == "stdout" and targetCF.outputDirectory is None:
+                    problems.append(
+                        f"{where}.readiness: stdout needs an outputDirectory"
+                    )
+        for name in (
+            "sampleInterval",
+            "resourceWindow",
+            "readyTimeout",
+            "stableUptime",
+            "restartBackoffMax",
+            "rollbackAfter",
+            "outputBuffer",
+        ):
+            if name not in mistyped and getattr(targetCF, name) < 0:
+                problems.append(f"{where}.{name}: can't be negative")
+    return problems
+
+
+def build(cls, table, where: str, problems: list[str]):
+    """Returns an instance of a config dataclass from a table of settings"""
+    if not isinstance(table, dict):
+        problems.append(f"{where}: expected a table, got {table!r}")
+        return None
+    known = {entry.name for entry in fields(cls)}
+    for key in table:
+        if key not in known:
+            problems.append(f"{where}: unknown setting {key!r}")
+    return cls(**{key: val for key, val in table.items() if key in known})
+
+
+def load(itemPath: str) -> tuple[CORE, list[TARGET]] | None:
+    """Returns the core and target config from a TOML/JSON file, None if it isn't valid.
+    Settings it doesn't set keep their defaults from triggerConfig.py"""
+    log.debug(f"run| {itemPath=}")
+    try:
+        with open(itemPath, "rb") as file:
+            if itemPath.endswith(".toml"):
+                try:
+                    import tomllib
+                except ImportError:
+                    log.error("TOML Config Needs Python 3.11+, Use JSON Instead")
+                    return None
+                data = tomllib.load(file)
+            else:
+                data = json.load(file)
+    except Exception:
+        log.exception("Config Load")
+        return None
+    problems = []
+    if not isinstance(data, dict):
+        data = {}
+        problems.append("expected a table of core and targets")
+    for key in data:
+        if key not in ("core", "targets"):
+            problems.append(f"unknown section {key!r}")
+    core = build(CORE, data.get("core", {}), "core", problems)
+    tables = data.get("targets", [{}])
+    if not isinstance(tables, list):
+        problems.append("targets: expected a list of tables")
+        tables = []
+    targets = [
+        build(TARGET, table, f"targets[{index}]", problems)
+        for index, table in enumerate(tables)
+    ]
+    if core is not None and None not in targets:
+        problems += validate(core, targets)
+    for problem in problems:
+        log.error(f"Config {problem}")
+    if problems:
+        return None
+    log.info(f"Config Loaded| {len(targets)} target(s)| {itemPath=}")
+    return core, targets
+
+
+def changed(current, new) -> list[str]:
+    """Returns names of the fields that differ between two config dataclasses"""
+    return [
+        entry.name
+        for entry in fields(current)
+        if getattr(current, entry.name) != getattr(new, entry.name)
+    ]
+
+
+def copy(current, new, names: list[str]):
+    """Sets the named fields of current to those of new"""
+    for name in names:
+        setattr(current, name, getattr(new, name))
+
+
+class Watcher:
+    """Loads the config file again whenever it's changed, passing it to apply(core, targets).
+    Only the file's mtime and size are checked each interval"""
+
+    def __init__(
+        self,
+        itemPath: str,
+        apply: Callable[[CORE, list[TARGET]], object],
+        interval: float = 2,
+    ):
+        self.itemPath = itemPath
+        self.apply = apply
+        self.interval = interval
+        self.stamp = self.read_stamp()
+
+    def read_stamp(self) -> tuple[int, int] | None:
+        try:
+            stat = os.stat(self.itemPath)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    async def run(self):
+        import asyncio
+
+        while True:
+            await asyncio.sleep(self.interval)
+            stamp = self.read_stamp()
+            if stamp is None or stamp == self.stamp:
+                continue
+            self.stamp = stamp
+            log.info(f"Config Changed, Reloading| {self.itemPath=}")
+            loaded = await asyncio.to_thread(load, self.itemPath)
+            if loaded is None:
+                log.error("Config Reload Failed, Keeping Current Config")
+                continue
+            try:
+                self.apply(*loaded)
+            except Exception:
+                log.exception("Config Apply")
@@ -0,0 +1,147 @@
+# MIT APasz
+import hashlib
+import logging
+import mmap
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import release
+import venvs
+
+log = logging.getLogger("TSlog")
+
+# Files at least this size are hashed through mmap rather than read
+mmapSize = 1024 * 1024
+chunkSize = 1024 * 1024
+# Never counted as drift, made by running the release
+alwaysIgnored = {venvs.linkName, "__pycache__"}
+
+
+def blob_sha(itemPath: str) -> str:
+    """Returns the git blob sha of a file, or of a symlink's target"""
+    if os.path.islink(itemPath):
+        data = os.readlink(itemPath).encode()
+        return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+    size = os.path.getsize(itemPath)
+    hasher = hashlib.sha1(b"blob %d\0" % size)
+    with open(itemPath, "rb") as file:
+        if size >= mmapSize:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                hasher.update(mapped)
+        else:
+            while chunk := file.read(chunkSize):
+                hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def is_ignored(path: str, ignore: set[str]) -> bool:
+    """Whether path is in ignore, under a folder in it, or has a part in alwaysIgnored"""
+    parts = path.split("/")
+    if alwaysIgnored.intersection(parts):
+        return True
+    return any("/".join(parts[:index]) in ignore for index in range(1, len(parts) + 1))
+
+
+def walk(folder: str, ignore: set[str], prefix: str = "") -> dict[str, os.DirEntry]:
+    """Returns {path relative to folder: entry} of every file and symlink under folder,
+    skipping the relative paths in ignore and what's under them"""
+    found = {}
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            path = prefix + entry.name
+            if path in ignore or entry.name in alwaysIgnored:
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                found |= walk(entry.path, ignore, prefix=f"{path}/")
+            else:
+                found[path] = entry
+    return found
+
+
+def scan(releasePath: str, ignore: list[str]) -> dict[str, list[str]] | None:
+    """Compares a release with its manifest. Files whose size and mtime match it are
+    taken as unchanged, the rest are hashed in parallel.
+    Returns {"modified", "missing", "extra": [paths]}, None if it has no manifest of files"""
+    manifest = release.load_manifest(releasePath)
+    files = manifest.get("files", {})
+    if not files:
+        log.warning(f"Release Has No Manifest Of Files| {releasePath=}")
+        return None
+    stats = manifest.get("stats", {})
+    st = time.perf_counter()
+    ignored = {os.path.normpath(item).replace(os.sep, "/") for item in ignore}
+    found = walk(releasePath, ignored)
+    drift = {
+        "modified": [],
+        "missing": [
+            path
+            for path in files
+            if path not in found and not is_ignored(path, ignored)
+        ],
+        "extra": sorted(path for path in found if path not in files),
+    }
+    toHash = []
+    for path, entry in found.items():
+        if path not in files:
+            continue
+        if not entry.is_symlink():
+            stat = entry.stat(follow_symlinks=False)
+            if stats.get(path) == [stat.st_size, stat.st_mtime_ns]:
+                continue
+        toHash.append(path)
+    with ThreadPoolExecutor() as pool:
+        shas = pool.map(lambda path: blob_sha(found[path].path), toHash)
+        for path, sha in zip(toHash, shas):
+            if sha != files[path]:
+                drift["modified"].append(path)
+    en = time.perf_counter()
+    metrics.record("scan", "drift", st, en - st, hashed=len(toHash))
+    log.info(
+        f"Drift Scanned| {len(found)} files, {len(toHash)} hashed| "
+        f"{ {key: len(val) for key, val in drift.items()} }"
+    )
+    return drift
+
+
+def sync(
+    releasePath: str, mirrorPath: str, drift: dict[str, list[str]]
+) -> dict[str, int] | None:
+    """Restores the modified and missing files of a release from the git objects of its
+    commit and removes the extra ones. Nothing else is touched.
+    Files are replaced rather than written into, as releases may share them by hardlink"""
+    from git import Repo
+
+    manifest = release.load_manifest(releasePath)
+    stats = manifest.setdefault("stats", {})
+    counts = {"restored": 0, "removed": 0}
+    try:
+        tree = Repo(mirrorPath).commit(manifest["commit"]).tree
+        for path in drift["modified"] + drift["missing"]:
+            item = tree / path
+            itemPath = os.path.join(releasePath, path)
+            tmpPath = f"{itemPath}.tmp"
+            os.makedirs(os.path.dirname(itemPath), exist_ok=True)
+            if os.path.lexists(tmpPath):
+                os.remove(tmpPath)
+            if item.mode == 0o120000:
+                os.symlink(item.data_stream.read().decode(), tmpPath)
+            else:
+                with open(tmpPath, "wb") as file:
+                    item.stream_data(file)
+                os.chmod(tmpPath, 0o755 if item.mode & 0o111 else 0o644)
+            os.replace(tmpPath, itemPath)
+            if item.mode != 0o120000:
+                stat = os.stat(itemPath)
+                stats[path] = [stat.st_size, stat.st_mtime_ns]
+            counts["restored"] += 1
+        for path in drift["extra"]:
+            os.remove(os.path.join(releasePath, path))
+            counts["removed"] += 1
+    except Exception:
+        log.exception("Drift Sync")
+        return None
+    release.write_manifest(releasePath, manifest)
+    log.info(f"Drift Synced| {counts=}| {releasePath=}")
+    return counts
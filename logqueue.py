@@ -0,0 +1,129 @@
+# MIT APasz
+import atexit
+import gzip
+import logging
+import os
+import queue
+import shutil
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+
+class CompressingFileHandler(RotatingFileHandler):
+    """Rotates once the log reaches maxBytes or is maxAge seconds old, gzipping old logs.
+    Its age is from when it was started, kept beside it in <log>.start, so restarts and
+    reloads don't make it any younger"""
+
+    def __init__(
+        self, filename: str, maxBytes: int = 0, backupCount: int = 0, maxAge: float = 0
+    ):
+        super().__init__(filename=filename, encoding="utf-8")
+        self.namer = lambda name: name + ".gz"
+        self.rotator = self.compress
+        self.startPath = self.baseFilename + ".start"
+        self.started = self.read_start()
+        self.limit(maxBytes=maxBytes, backupCount=backupCount, maxAge=maxAge)
+
+    def read_start(self) -> float:
+        """Returns when the log was started. One older than its record of that is taken
+        to be as old as its last write"""
+        try:
+            with open(self.startPath, "r") as file:
+                return float(file.read())
+        except (OSError, ValueError):
+            pass
+        started = min(os.path.getmtime(self.baseFilename), time.time())
+        self.write_start(started)
+        return started
+
+    def write_start(self, started: float):
+        try:
+            with open(self.startPath, "w") as file:
+                file.write(repr(started))
+        except OSError:
+            pass
+
+    def limit(self, maxBytes: int, backupCount: int, maxAge: float):
+        """Sets when to rotate, 0 to not rotate on size/age, and how many old logs to keep"""
+        self.maxBytes = maxBytes
+        self.backupCount = backupCount
+        self.maxAge = maxAge
+        self.rolloverAt = self.started + maxAge if maxAge else None
+
+    @staticmethod
+    def compress(source: str, destination: str):
+        with open(source, "rb") as src, gzip.open(destination, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(source)
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if not self.backupCount:
+            return False
+        if self.rolloverAt is not None and time.time() >= self.rolloverAt:
+            return True
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self):
+        super().doRollover()
+        self.started = time.time()
+        self.write_start(self.started)
+        self.limit(self.maxBytes, self.backupCount, self.maxAge)
+
+
+class SizedQueue(queue.Queue):
+    """Unbounded queue that keeps count of the length of the messages waiting in it"""
+
+    def _init(self, maxsize: int):
+        super()._init(maxsize)
+        self.length = 0
+
+    @staticmethod
+    def measure(record: logging.LogRecord | None) -> int:
+        return 0 if record is None else len(record.msg)
+
+    def _put(self, record: logging.LogRecord | None):
+        super()._put(record)
+        self.length += self.measure(record)
+
+    def _get(self) -> logging.LogRecord | None:
+        record = super()._get()
+        self.length -= self.measure(record)
+        return record
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Drops records once maxLength of messages are waiting, rather than blocking or
+    growing without limit"""
+
+    dropped = 0
+
+    def __init__(self, logQueue: SizedQueue, maxLength: int):
+        super().__init__(logQueue)
+        self.maxLength = maxLength
+
+    def enqueue(self, record: logging.LogRecord):
+        if self.queue.length >= self.maxLength:
+            self.dropped += 1
+            return
+        self.queue.put_nowait(record)
+
+
+def start(
+    log: logging.Logger, handlers: list[logging.Handler], maxLength: int = 0
+) -> QueueListener:
+    """Moves handlers off log onto a background thread, so a slow disk or console never
+    holds up whatever is logging. Records are queued and written in order.
+    If maxLength is set, records are dropped while messages that long in total are waiting"""
+    for handler in handlers:
+        log.removeHandler(handler)
+    if maxLength:
+        logQueue = SizedQueue()
+        log.addHandler(DroppingQueueHandler(logQueue, maxLength=maxLength))
+    else:
+        logQueue = queue.SimpleQueue()
+        log.addHandler(QueueHandler(logQueue))
+    listener = QueueListener(logQueue, *handlers, respect_handler_level=True)
+    listener.start()
+    # Flushes whatever is still queued on the way out
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,169 @@
+# MIT APasz
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+log = logging.getLogger("TSlog")
+
+startWall = time.time()
+startPerf = time.perf_counter()
+lock = threading.Lock()
+# Latest finished spans, {"name", "cat", "start", "duration", "tid", "args"}, times in
+# seconds. Capped, as the daemon modes record spans for as long as they run
+maxSpans = 10000
+spans = deque(maxlen=maxSpans)
+# {(cat, name): [count, seconds]} of every span, including those no longer in spans
+totals = {}
+# {(name, labels): value}
+counters = {}
+gauges = {}
+
+
+def label_key(labels: dict) -> tuple:
+    return tuple(sorted((key, str(val)) for key, val in labels.items()))
+
+
+def record(name: str, cat: str, start: float, duration: float, /, **args):
+    """Records a finished span. start is a time.perf_counter() value"""
+    with lock:
+        total = totals.setdefault((cat, name), [0, 0.0])
+        total[0] += 1
+        total[1] += duration
+        spans.append(
+            {
+                "name": name,
+                "cat": cat,
+                "start": start - startPerf,
+                "duration": duration,
+                "tid": threading.get_ident(),
+                "args": args,
+            }
+        )
+
+
+@contextmanager
+def span(name: str, cat: str, /, **args):
+    """Times the enclosed block as a span of category cat"""
+    st = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, cat, st, time.perf_counter() - st, **args)
+
+
+def add(name: str, value: float = 1, /, **labels):
+    """Adds value to a counter"""
+    key = (name, label_key(labels))
+    with lock:
+        counters[key] = counters.get(key, 0) + value
+
+
+def gauge(name: str, value: float, /, **labels):
+    """Sets a gauge"""
+    with lock:
+        gauges[(name, label_key(labels))] = value
+
+
+def escape_label(value: str) -> str:
+    """Escapes a label value for the Prometheus text format"""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def series_name(name: str, labels: tuple) -> str:
+    if not labels:
+        return name
+    pairs = ",".join(f'{key}="{escape_label(val)}"' for key, val in labels)
+    return f"{name}{{{pairs}}}"
+
+
+def span_totals() -> dict[tuple[str, str], list]:
+    """Returns {(cat, name): [count, seconds]}"""
+    with lock:
+        return {key: list(total) for key, total in totals.items()}
+
+
+def summary() -> dict:
+    """Returns everything recorded so far"""
+    byCat = {}
+    for (cat, name), (count, seconds) in span_totals().items():
+        byCat.setdefault(cat, {})[name] = {"count": count, "seconds": seconds}
+    with lock:
+        return {
+            "pid": os.getpid(),
+            "started": startWall,
+            "elapsed": time.perf_counter() - startPerf,
+            "spans": byCat,
+            "counters": {series_name(*key): val for key, val in counters.items()},
+            "gauges": {series_name(*key): val for key, val in gauges.items()},
+        }
+
+
+def prometheus() -> str:
+    """Returns everything recorded so far in the Prometheus text format"""
+    lines = []
+    byCat = {}
+    for (cat, name), total in sorted(span_totals().items()):
+        byCat.setdefault(cat, []).append((name, total))
+    for cat, items in byCat.items():
+        metric = f"triggerscript_{cat}_seconds"
+        lines.append(f"# TYPE {metric} summary")
+        for name, (count, seconds) in items:
+            labels = label_key({cat: name})
+            lines.append(f"{series_name(metric + '_sum', labels)} {seconds}")
+            lines.append(f"{series_name(metric + '_count', labels)} {count}")
+    with lock:
+        for kind, store in (("counter", counters), ("gauge", gauges)):
+            seen = set()
+            for (name, labels), val in sorted(store.items()):
+                metric = f"triggerscript_{name}"
+                if metric not in seen:
+                    lines.append(f"# TYPE {metric} {kind}")
+                    seen.add(metric)
+                lines.append(f"{series_name(metric, labels)} {val}")
+    return "\n".join(lines) + "\n"
+
+
+def trace() -> dict:
+    """Returns the latest spans as a Chrome trace (chrome://tracing, Perfetto)"""
+    with lock:
+        events = [
+            {
+                "name": item["name"],
+                "cat": item["cat"],
+                "ph": "X",
+                "ts": item["start"] * 1e6,
+                "dur": item["duration"] * 1e6,
+                "pid": os.getpid(),
+                "tid": item["tid"],
+                "args": item["args"],
+            }
+            for item in spans
+        ]
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def write_atomic(itemPath: str, text: str):
+    tmpPath = itemPath + ".tmp"
+    with open(tmpPath, "w", encoding="utf-8") as file:
+        file.write(text)
+    os.replace(tmpPath, itemPath)
+
+
+def export(folder: str, withTrace: bool = False) -> bool:
+    """Writes metrics.prom, summary.json and optionally trace.json into folder"""
+    try:
+        os.makedirs(folder, exist_ok=True)
+        write_atomic(os.path.join(folder, "metrics.prom"), prometheus())
+        write_atomic(
+            os.path.join(folder, "summary.json"), json.dumps(summary(), indent=4)
+        )
+        if withTrace:
+            write_atomic(os.path.join(folder, "trace.json"), json.dumps(trace()))
+    except Exception:
+        log.exception("Metrics Export")
+        return False
+    return True
@@ -0,0 +1,102 @@
+# MIT APasz
+import logging
+import os
+import re
+
+import metrics
+
+log = logging.getLogger("TSlog")
+
+
+def remote_url(repository: str) -> str:
+    """Returns URL for repository. "user/repo" is fetched from Github, URLs/paths are used as is"""
+    if (
+        "://" in repository
+        or repository.startswith("git@")
+        or os.path.isdir(repository)
+    ):
+        return repository
+    return f"http://github.com/{repository}.git"
+
+
+def mirror_name(repository: str) -> str:
+    """Returns a folder name for the mirror of repository"""
+    name = repository.strip("/").removesuffix(".git")
+    return re.sub(r"[^\w.-]+", "_", name) + ".git"
+
+
+def remote_head(url: str) -> str | None:
+    """Returns the commit the remote HEAD points at, without fetching anything"""
+    log.debug(f"run| {url=}")
+    from git.cmd import Git
+
+    try:
+        with metrics.span("ls-remote", "git", url=url):
+            refs = Git().ls_remote(url, "HEAD")
+    except Exception:
+        log.exception("ls-remote")
+        return None
+    if not refs:
+        log.error(f"Remote Has No HEAD| {url=}")
+        return None
+    return refs.split()[0]
+
+
+def object_bytes(repo) -> int:
+    """Returns bytes of a repo's loose and packed objects, as git counts them"""
+    counts = dict(
+        line.split(": ", maxsplit=1)
+        for line in repo.git.count_objects("-v").splitlines()
+    )
+    return (int(counts.get("size", 0)) + int(counts.get("size-pack", 0))) * 1024
+
+
+def update_mirror(url: str, mirrorPath: str, depth: int | None = None) -> bool:
+    """Creates a bare mirror of url at mirrorPath, or fetches into it if it exists"""
+    log.debug(f"run| {depth=}| {url=}| {mirrorPath=}")
+    from git import Repo
+
+    try:
+        if os.path.exists(mirrorPath):
+            repo = Repo(mirrorPath)
+            repo.remotes.origin.set_url(url)
+        else:
+            repo = Repo.init(mirrorPath, bare=True, mkdir=True)
+            repo.create_remote("origin", url)
+            log.info(f"Mirror Created| {mirrorPath=}")
+        depthArgs = ["--depth", str(depth)] if depth else []
+        sizeBefore = object_bytes(repo)
+        with metrics.span("fetch", "git", url=url):
+            repo.git.fetch(
+                *depthArgs,
+                "--prune",
+                "--force",
+                "origin",
+                "refs/heads/*:refs/heads/*",
+                "refs/tags/*:refs/tags/*",
+            )
+        fetched = max(object_bytes(repo) - sizeBefore, 0)
+    except Exception:
+        log.exception("Mirror Fetch")
+        return False
+    metrics.add("mirror_fetch_bytes_total", fetched)
+    log.debug("Mirror Fetched")
+    return True
+
+
+def read_file(mirrorPath: str, commit: str, path: str) -> tuple[str, bytes] | None:
+    """Returns (blob sha, content) of path at commit, read straight from the git objects
+    without a checkout. None if commit has no such file"""
+    log.debug(f"run| {commit=}| {path=}")
+    from git import Repo
+
+    try:
+        with metrics.span("read-file", "git", path=path):
+            blob = Repo(mirrorPath).commit(commit).tree / path
+            return blob.hexsha, blob.data_stream.read()
+    except KeyError:
+        log.warning(f"Not In Commit| {commit=}| {path=}")
+        return None
+    except Exception:
+        log.exception("Mirror Read File")
+        return None
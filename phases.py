@@ -0,0 +1,66 @@
+# MIT APasz
+import logging
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from graphlib import TopologicalSorter
+from typing import Callable
+
+import metrics
+
+log = logging.getLogger("TSlog")
+
+
+@dataclass(slots=True)
+class Phase:
+    """A startup step. Runs once every phase named in after has finished"""
+
+    name: str
+    func: Callable[[], bool]
+    after: tuple[str, ...] = ()
+    # If a required phase fails, phases after it are skipped and the run fails
+    required: bool = True
+
+
+def run_phases(phases: list[Phase]) -> dict[str, bool | None]:
+    """Runs phases concurrently, each as soon as its dependencies are done.
+    Returns {name: True/False, None if skipped}"""
+    byName = {phase.name: phase for phase in phases}
+    graph = TopologicalSorter()
+    for phase in phases:
+        for dep in phase.after:
+            if dep not in byName:
+                raise ValueError(f"Phase {phase.name} is after unknown phase {dep}")
+        graph.add(phase.name, *phase.after)
+    order = list(graph.static_order())
+    futures: dict[str, Future] = {}
+
+    def work(phase: Phase) -> bool | None:
+        for dep in phase.after:
+            if not futures[dep].result() and byName[dep].required:
+                log.error(f"Skipping {phase.name}, {dep} Failed")
+                return None
+        log.info(f"Phase {phase.name} Started")
+        st = time.perf_counter()
+        try:
+            ok = bool(phase.func())
+        except Exception:
+            log.exception(f"Phase {phase.name}")
+            ok = False
+        en = time.perf_counter()
+        metrics.record(phase.name, "phase", st, en - st, ok=ok)
+        if ok:
+            log.info(f"Phase {phase.name} Successful {round((en - st) * 1000)}ms")
+        else:
+            log.error(f"Phase {phase.name} Failed! {round((en - st) * 1000)}ms")
+        return ok
+
+    with ThreadPoolExecutor(max_workers=len(order) or 1) as pool:
+        for name in order:
+            futures[name] = pool.submit(work, byName[name])
+        return {name: futures[name].result() for name in order}
+
+
+def succeeded(phases: list[Phase], results: dict[str, bool | None]) -> bool:
+    """Whether every required phase succeeded"""
+    return all(results[phase.name] for phase in phases if phase.required)
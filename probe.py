@@ -0,0 +1,153 @@
+# MIT APasz
+import hashlib
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger("TSlog")
+
+routePath = "/proc/net/route"
+cacheLock = threading.Lock()
+
+
+def split_address(address: str, port: int) -> tuple[str, int]:
+    """Splits "host:port" into host and port, falling back to the given port"""
+    if address.startswith("["):
+        host, _, rest = address[1:].partition("]")
+        if rest.startswith(":") and rest[1:].isdigit():
+            return host, int(rest[1:])
+        return host, port
+    if address.count(":") == 1:
+        host, rest = address.split(":")
+        if rest.isdigit():
+            return host, int(rest)
+    return address, port
+
+
+def probe_host(address: str, port: int, timeout: float) -> float | None:
+    """Resolves and opens a TCP connection to address. Returns latency in ms, None if unreachable"""
+    host, port = split_address(address=address, port=port)
+    st = time.perf_counter()
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            pass
+    except OSError as xcp:
+        log.debug(f"{host=}| {port=}| {xcp}")
+        return None
+    en = time.perf_counter()
+    return (en - st) * 1000
+
+
+def probe_retry(
+    address: str, port: int, timeout: float, retry: int, paceErr: float
+) -> float | None:
+    """Probes address, retrying up to retry times with paceErr seconds between attempts"""
+    for attempt in range(retry + 1):
+        latency = probe_host(address=address, port=port, timeout=timeout)
+        if latency is not None:
+            return latency
+        log.debug(f"Attempt {attempt + 1} failed| {address=}")
+        if attempt < retry:
+            time.sleep(paceErr)
+    return None
+
+
+def probe_all(
+    hosts: dict[str, str], port: int, timeout: float, retry: int, paceErr: float
+) -> dict[str, float | None]:
+    """Probes every host at once. Returns {name: latency in ms or None}"""
+    if not hosts:
+        return {}
+    with ThreadPoolExecutor(max_workers=len(hosts)) as pool:
+        futures = {
+            name: pool.submit(probe_retry, address, port, timeout, retry, paceErr)
+            for name, address in hosts.items()
+        }
+        return {name: future.result() for name, future in futures.items()}
+
+
+def default_gateway() -> str | None:
+    """Returns the IPv4 default gateway, read from /proc/net/route where there is one,
+    otherwise from netifaces if it's installed"""
+    try:
+        with open(routePath, "r") as file:
+            lines = file.read().splitlines()[1:]
+    except OSError:
+        lines = None
+    if lines is not None:
+        for line in lines:
+            fields = line.split()
+            # Iface Destination Gateway Flags ..., in little endian hex. Flag 0x2 is RTF_GATEWAY
+            if len(fields) > 3 and fields[1] == "00000000" and int(fields[3], 16) & 2:
+                return socket.inet_ntoa(struct.pack("<L", int(fields[2], 16)))
+        return None
+    try:
+        import netifaces
+    except ImportError:
+        return None
+    try:
+        return netifaces.gateways()["default"][netifaces.AF_INET][0]
+    except (KeyError, IndexError):
+        return None
+
+
+def fingerprint() -> str:
+    """Returns a hash of the network interfaces and routes, which changes when either does"""
+    hasher = hashlib.sha256()
+    try:
+        with open(routePath, "rb") as file:
+            hasher.update(file.read())
+    except OSError:
+        pass
+    try:
+        hasher.update(repr(socket.if_nameindex()).encode())
+    except OSError:
+        pass
+    return hasher.hexdigest()[:16]
+
+
+def load_cache(cachePath: str) -> dict:
+    try:
+        with open(cachePath, "r") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+    except Exception:
+        log.exception("Probe Cache Load")
+        return {}
+
+
+def cached(cachePath: str, key: str, ttl: float) -> dict[str, float] | None:
+    """Returns latencies remembered under key within ttl seconds, None if there aren't any
+    or the network interfaces/routes have changed since"""
+    if not ttl:
+        return None
+    with cacheLock:
+        cache = load_cache(cachePath)
+    if cache.get("fingerprint") != fingerprint():
+        return None
+    entry = cache.get("results", {}).get(key)
+    if entry is None or not 0 <= time.time() - entry["time"] <= ttl:
+        return None
+    return entry["latencies"]
+
+
+def remember(cachePath: str, key: str, latencies: dict[str, float]):
+    """Remembers successful latencies under key"""
+    current = fingerprint()
+    with cacheLock:
+        cache = load_cache(cachePath)
+        if cache.get("fingerprint") != current:
+            cache = {"fingerprint": current, "results": {}}
+        cache["results"][key] = {"time": time.time(), "latencies": latencies}
+        try:
+            with open(cachePath + ".tmp", "w") as file:
+                json.dump(cache, file, indent=4)
+            os.replace(cachePath + ".tmp", cachePath)
+        except Exception:
+            log.exception("Probe Cache Store")
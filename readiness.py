@@ -0,0 +1,81 @@
+# MIT APasz
+import asyncio
+import logging
+import os
+import time
+
+import probe
+
+log = logging.getLogger("TSlog")
+
+# Seconds between attempts of the probes not yet passed
+interval = 0.5
+# Seconds each tcp/http attempt is given
+attemptTimeout = 2
+
+
+def check_tcp(address: str) -> bool:
+    return probe.probe_host(address=address, port=0, timeout=attemptTimeout) is not None
+
+
+def check_http(url: str) -> bool:
+    import urllib.error
+    import urllib.request
+
+    try:
+        with urllib.request.urlopen(url, timeout=attemptTimeout) as resp:
+            return resp.status < 400
+    except (urllib.error.URLError, OSError, ValueError) as xcp:
+        log.debug(f"{url=}| {xcp}")
+        return False
+
+
+def check(kind: str, value: str, wd: str, marker: asyncio.Event | None) -> bool:
+    """Whether one readiness probe passes, kind is one of config.readinessKinds"""
+    if kind == "tcp":
+        return check_tcp(value)
+    if kind == "file":
+        return os.path.exists(os.path.join(wd, value))
+    if kind == "stdout":
+        return marker is not None and marker.is_set()
+    if kind == "http":
+        return check_http(value)
+    return False
+
+
+async def wait(
+    readiness: dict[str, str],
+    wd: str,
+    proc: asyncio.subprocess.Process,
+    timeout: float,
+    marker: asyncio.Event | None = None,
+    st: float | None = None,
+) -> float | None:
+    """Waits for every probe in readiness to pass. Returns seconds since st until they did,
+    None if proc exited or they hadn't within timeout"""
+    st = time.perf_counter() if st is None else st
+    remaining = dict(readiness)
+    while proc.returncode is None:
+        results = await asyncio.gather(
+            *(
+                asyncio.to_thread(check, kind, value, wd, marker)
+                for kind, value in remaining.items()
+            )
+        )
+        for kind, passed in zip(list(remaining), results):
+            if passed:
+                log.debug(f"Ready| {kind=}| {proc.pid=}")
+                del remaining[kind]
+        elapsed = time.perf_counter() - st
+        if not remaining:
+            return elapsed
+        if elapsed >= timeout:
+            log.debug(f"Not Ready| {list(remaining)}| {proc.pid=}")
+            return None
+        try:
+            await asyncio.wait_for(
+                proc.wait(), timeout=min(interval, timeout - elapsed)
+            )
+        except asyncio.TimeoutError:
+            pass
+    return None
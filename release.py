@@ -0,0 +1,243 @@
+# MIT APasz
+import json
+import logging
+import os
+import time
+
+import metrics
+import util
+
+log = logging.getLogger("TSlog")
+
+
+def manifest_path(releasePath: str) -> str:
+    """Returns path of the manifest kept beside a release folder"""
+    return releasePath.rstrip(os.sep) + ".json"
+
+
+def load_manifest(releasePath: str) -> dict:
+    """Returns the manifest of a release, empty if it has none"""
+    try:
+        with open(manifest_path(releasePath), "r") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+    except Exception:
+        log.exception("Release Manifest Load")
+        return {}
+
+
+def write_manifest(releasePath: str, manifest: dict) -> bool:
+    """Writes the manifest of a release"""
+    tmpPath = manifest_path(releasePath) + ".tmp"
+    try:
+        with open(tmpPath, "w") as file:
+            json.dump(manifest, file, indent=4)
+        os.replace(tmpPath, manifest_path(releasePath))
+        return True
+    except Exception:
+        log.exception("Release Manifest Write")
+        return False
+
+
+def current(activePath: str) -> str | None:
+    """Returns path of the release activePath links to, None if not a release link"""
+    if not os.path.islink(activePath):
+        return None
+    return os.path.realpath(activePath)
+
+
+def deployed_commit(activePath: str) -> str | None:
+    """Returns the commit of the active release"""
+    releasePath = current(activePath)
+    if releasePath is None:
+        return None
+    return load_manifest(releasePath).get("commit")
+
+
+def listing(releasesDir: str) -> list[str]:
+    """Returns resolved paths of all releases, oldest first, so they compare equal
+    to current() even when releasesDir is reached through a symlink"""
+    if not os.path.isdir(releasesDir):
+        return []
+    found = []
+    for entry in os.scandir(os.path.realpath(releasesDir)):
+        if entry.is_dir(follow_symlinks=False) and not entry.name.endswith(".tmp"):
+            created = load_manifest(entry.path).get("created", 0)
+            found.append((created, entry.path))
+    return [releasePath for _, releasePath in sorted(found)]
+
+
+def activate(activePath: str, releasePath: str) -> bool:
+    """Atomically points activePath at releasePath"""
+    log.debug(f"run| {activePath=}| {releasePath=}")
+    tmpLink = activePath.rstrip(os.sep) + ".tmp"
+    linkTo = os.path.relpath(releasePath, os.path.dirname(activePath))
+    try:
+        if os.path.lexists(tmpLink):
+            os.remove(tmpLink)
+        os.symlink(linkTo, tmpLink, target_is_directory=True)
+        os.replace(tmpLink, activePath)
+    except Exception:
+        log.exception("Activate Release")
+        return False
+    log.info(f"Release Activated| {releasePath=}")
+    return True
+
+
+def adopt_legacy(activePath: str, releasesDir: str) -> bool:
+    """Turns a plain active folder into a release, so it can be swapped out atomically"""
+    if os.path.islink(activePath) or not os.path.isdir(activePath):
+        return True
+    log.info(f"Adopting Legacy Folder As Release| {activePath=}")
+    os.makedirs(releasesDir, exist_ok=True)
+    releasePath = os.path.join(releasesDir, f"legacy-{int(time.time())}")
+    try:
+        os.rename(activePath, releasePath)
+    except Exception:
+        log.exception("Adopt Legacy")
+        return False
+    write_manifest(releasePath, {"commit": None, "created": time.time(), "files": {}})
+    if activate(activePath=activePath, releasePath=releasePath):
+        return True
+    # Put the folder back, so the target is still where it was
+    try:
+        os.rename(releasePath, activePath)
+        util.remove_thing(itemPath=manifest_path(releasePath), isFile=True)
+    except Exception:
+        log.exception("Adopt Legacy Restore")
+    return False
+
+
+def mark_failed(releasePath: str, reason: str) -> bool:
+    """Records in a release's manifest that it failed, so it isn't deployed again"""
+    manifest = load_manifest(releasePath)
+    manifest["failed"] = {"reason": reason, "time": time.time()}
+    return write_manifest(releasePath, manifest)
+
+
+def failed(releasesDir: str, commit: str) -> bool:
+    """Whether the release of commit failed, so isn't to be deployed again"""
+    manifest = load_manifest(os.path.join(releasesDir, commit[:12]))
+    return manifest.get("commit") == commit and "failed" in manifest
+
+
+def rollback(activePath: str, releasesDir: str) -> str | None:
+    """Activates the release before the active one, marking the active one failed in
+    its manifest. Returns the path activated"""
+    releases = listing(releasesDir)
+    active = current(activePath)
+    if active not in releases or releases.index(active) == 0:
+        log.error(f"No Previous Release To Roll Back To| {active=}")
+        return None
+    previous = releases[releases.index(active) - 1]
+    if not activate(activePath=activePath, releasePath=previous):
+        return None
+    mark_failed(active, reason="rolledBack")
+    return previous
+
+
+def prune(activePath: str, releasesDir: str, keep: int) -> list[str]:
+    """Removes all but the newest keep releases, never the active one. Returns those removed"""
+    active = current(activePath)
+    removed = []
+    for releasePath in listing(releasesDir)[: -keep or None]:
+        if releasePath == active:
+            continue
+        if util.remove_thing(itemPath=releasePath, isFile=False):
+            util.remove_thing(itemPath=manifest_path(releasePath), isFile=True)
+            removed.append(releasePath)
+    return removed
+
+
+def hardlink(source: str, destination: str) -> bool:
+    """Hardlinks source to destination. Returns False if the filesystem won't allow it"""
+    try:
+        os.link(source, destination)
+        return True
+    except OSError:
+        return False
+
+
+def unchanged(releasePath: str, path: str, stats: dict) -> bool:
+    """Whether a file of a release still has the size and mtime its manifest recorded.
+    Releases from before stats were recorded are trusted"""
+    if path not in stats:
+        return not stats
+    try:
+        stat = os.stat(os.path.join(releasePath, path))
+    except OSError:
+        return False
+    return stats[path] == [stat.st_size, stat.st_mtime_ns]
+
+
+def build(
+    mirrorPath: str, commit: str, releasesDir: str, previous: str | None
+) -> str | None:
+    """Writes the tree of commit into a new release folder. Files unchanged since
+    the previous release are hardlinked from it. Returns the release path"""
+    log.debug(f"run| {commit=}| {mirrorPath=}| {previous=}")
+    from git import Repo
+
+    releasePath = os.path.join(releasesDir, commit[:12])
+    if load_manifest(releasePath).get("commit") == commit:
+        log.info(f"Release Already Built| {releasePath=}")
+        return releasePath
+    staging = releasePath + ".tmp"
+    for itemPath in (staging, releasePath):
+        if os.path.exists(itemPath):
+            util.remove_thing(itemPath=itemPath, isFile=False)
+    prevManifest = load_manifest(previous) if previous else {}
+    prevFiles = prevManifest.get("files", {})
+    prevStats = prevManifest.get("stats", {})
+    files = {}
+    # {path: [size, mtime_ns]}, so drift can be found without hashing every file
+    stats = {}
+    linked = 0
+    written = 0
+    st = time.perf_counter()
+    try:
+        tree = Repo(mirrorPath).commit(commit).tree
+        os.makedirs(staging)
+        for item in tree.traverse():
+            if item.type != "blob":
+                continue
+            itemPath = os.path.join(staging, item.path)
+            os.makedirs(os.path.dirname(itemPath), exist_ok=True)
+            files[item.path] = item.hexsha
+            if item.mode == 0o120000:
+                os.symlink(item.data_stream.read().decode(), itemPath)
+                continue
+            if (
+                prevFiles.get(item.path) == item.hexsha
+                and unchanged(previous, item.path, prevStats)
+                and hardlink(
+                    source=os.path.join(previous, item.path), destination=itemPath
+                )
+            ):
+                linked += 1
+                metrics.add("release_bytes_total", item.size, how="linked")
+            else:
+                with open(itemPath, "wb") as file:
+                    item.stream_data(file)
+                written += 1
+                metrics.add("release_bytes_total", item.size, how="written")
+                if item.mode & 0o111:
+                    os.chmod(itemPath, 0o755)
+            stat = os.stat(itemPath)
+            stats[item.path] = [stat.st_size, stat.st_mtime_ns]
+        os.rename(staging, releasePath)
+    except Exception:
+        log.exception("Build Release")
+        return None
+    metrics.record("build", "release", st, time.perf_counter() - st, commit=commit)
+    log.info(f"Release Built| {written} written, {linked} linked| {releasePath=}")
+    manifest = {
+        "commit": commit,
+        "created": time.time(),
+        "files": files,
+        "stats": stats,
+    }
+    if not write_manifest(releasePath, manifest):
+        return None
+    return releasePath
@@ -0,0 +1,80 @@
+# MIT APasz
+import hashlib
+import json
+import logging
+import os
+import platform
+import sys
+
+log = logging.getLogger("TSlog")
+
+
+def cache_key(itemPath: str) -> str:
+    """Returns key for a requirements file, its content hash plus the interpreter"""
+    with open(itemPath, "rb") as file:
+        digest = hashlib.sha256(file.read()).hexdigest()
+    return f"{digest}|{sys.executable}|{platform.python_version()}"
+
+
+def load_cache(cachePath: str) -> dict:
+    """Returns {requirements path: key} of files last known to be satisfied"""
+    try:
+        with open(cachePath, "r") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+    except Exception:
+        log.exception("Requirements Cache Load")
+        return {}
+
+
+def is_cached(cachePath: str, itemPath: str) -> bool:
+    """Whether itemPath is unchanged since it was last satisfied by this interpreter"""
+    return load_cache(cachePath).get(os.path.realpath(itemPath)) == cache_key(itemPath)
+
+
+def store(cachePath: str, itemPath: str):
+    """Records itemPath as satisfied"""
+    cache = load_cache(cachePath)
+    cache[os.path.realpath(itemPath)] = cache_key(itemPath)
+    try:
+        with open(cachePath, "w") as file:
+            json.dump(cache, file, indent=4)
+    except Exception:
+        log.exception("Requirements Cache Store")
+
+
+def unsatisfied(itemPath: str) -> list[str] | None:
+    """Returns requirements in itemPath the installed distributions don't satisfy.
+    None if the file uses something other than plain requirement lines"""
+    log.debug(f"run| {itemPath=}")
+    from importlib import metadata
+
+    from packaging.requirements import InvalidRequirement, Requirement
+
+    missing = []
+    with open(itemPath, "r") as file:
+        lines = file.read().splitlines()
+    for line in lines:
+        line = line.split(" #", maxsplit=1)[0].strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            req = Requirement(line)
+        except InvalidRequirement:
+            log.debug(f"Not a plain requirement| {line=}")
+            return None
+        if req.url:
+            return None
+        if req.marker and not req.marker.evaluate():
+            continue
+        try:
+            installed = metadata.version(req.name)
+        except metadata.PackageNotFoundError:
+            log.debug(f"Missing| {line=}")
+            missing.append(line)
+            continue
+        if not req.specifier.contains(installed, prereleases=True):
+            log.debug(f"Mismatched| {installed=}| {line=}")
+            missing.append(line)
+    return missing
@@ -0,0 +1,105 @@
+# MIT APasz
+import json
+import logging
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+log = logging.getLogger("TSlog")
+
+# Sets the rlimits given as JSON, then becomes the command after them. Run as a separate
+# interpreter rather than a preexec_fn, which isn't safe with our threads
+rlimitShim = """import json, os, resource, sys
+for name, limit in json.loads(sys.argv[1]).items():
+    resource.setrlimit(getattr(resource, "RLIMIT_" + name.upper()), (limit, limit))
+os.execv(sys.argv[2], sys.argv[2:])
+"""
+
+clockTicks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+pageSize = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+# Multiplier from each threshold's config unit to its sample unit
+thresholdUnits = {"rss": 1024 * 1024, "cpu": 1, "fds": 1, "threads": 1}
+# Sample key: metric it's exported as
+gaugeNames = {
+    "rss": "target_rss_bytes",
+    "cpu": "target_cpu_percent",
+    "cputime": "target_cpu_seconds",
+    "fds": "target_open_fds",
+    "threads": "target_threads",
+}
+
+
+def sample(pid: int) -> dict | None:
+    """Returns rss (bytes), cputime (seconds), fds and threads of pid from /proc.
+    None if it can't be read, as on systems without /proc or once pid has exited"""
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as file:
+            stat = file.read()
+        fds = len(os.listdir(f"/proc/{pid}/fd"))
+    except OSError:
+        return None
+    # The command name may hold spaces or brackets, fields are counted from after it
+    fields = stat.rsplit(b")", maxsplit=1)[1].split()
+    return {
+        "rss": int(fields[21]) * pageSize,
+        "cputime": (int(fields[11]) + int(fields[12])) / clockTicks,
+        "fds": fds,
+        "threads": int(fields[17]),
+    }
+
+
+def rlimit_known(name: str) -> bool:
+    """Whether name ("NOFILE", "AS", "CPU", etc.) is an rlimit of this system.
+    Any name is taken where rlimits aren't supported, they're then not applied"""
+    return resource is None or hasattr(resource, f"RLIMIT_{name.upper()}")
+
+
+def rlimit_command(comm: list[str], rlimits: dict[str, int]) -> list[str]:
+    """Returns comm run through rlimitShim, so each rlimit is set, soft and hard, before
+    comm is exec'd in the same process and holds from its first instruction.
+    comm as is if there are none to set"""
+    if not rlimits:
+        return comm
+    if resource is None:
+        log.warning("rlimits Unsupported On This System")
+        return comm
+    return [sys.executable, "-S", "-c", rlimitShim, json.dumps(rlimits), *comm]
+
+
+class Watch:
+    """Tracks samples of one process, saying when a threshold has been exceeded for
+    every sample over window seconds. thresholds uses config units: rss MiB, cpu percent"""
+
+    def __init__(self, thresholds: dict[str, float], window: float):
+        self.thresholds = thresholds
+        self.window = window
+        self.last = None
+        # {threshold name: time it was first exceeded}
+        self.since = {}
+
+    def add(self, current: dict, now: float | None = None) -> str | None:
+        """Adds a sample, filling in its cpu percent. Returns the threshold held exceeded
+        for the window, if any"""
+        now = time.monotonic() if now is None else now
+        if self.last is None:
+            current["cpu"] = 0.0
+        else:
+            spent = current["cputime"] - self.last[1]["cputime"]
+            current["cpu"] = spent / max(now - self.last[0], 1e-6) * 100
+        first = self.last is None
+        self.last = (now, current)
+        if first:
+            return None
+        for name, limit in self.thresholds.items():
+            if current[name] <= limit * thresholdUnits[name]:
+                self.since.pop(name, None)
+                continue
+            self.since.setdefault(name, now)
+            if now - self.since[name] >= self.window:
+                return name
+        return None
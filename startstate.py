@@ -0,0 +1,87 @@
+# MIT APasz
+import hashlib
+import json
+import logging
+import os
+import platform
+import sys
+import time
+from dataclasses import asdict
+
+log = logging.getLogger("TSlog")
+
+
+def config_hash(core, targets: list) -> str:
+    """Returns a hash of the core and target config"""
+    data = json.dumps(
+        [asdict(core), [asdict(targetCF) for targetCF in targets]],
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def stamps(paths: list[str]) -> dict[str, int | bool | None]:
+    """Returns {path: mtime_ns} of files, True for folders and None for those missing.
+    Only a folder's existence is checked, as targets write into theirs while running"""
+    found = {}
+    for itemPath in paths:
+        try:
+            stat = os.stat(itemPath)
+        except OSError:
+            found[itemPath] = None
+            continue
+        found[itemPath] = True if os.path.isdir(itemPath) else stat.st_mtime_ns
+    return found
+
+
+def state_key(core, targets: list, paths: list[str], commits: list) -> str:
+    """Returns the key of everything a successful startup's checks depend on"""
+    inputs = {
+        "config": config_hash(core, targets),
+        "interpreter": [sys.executable, platform.python_version()],
+        "paths": stamps(paths),
+        "commits": commits,
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+def load(statePath: str) -> dict:
+    try:
+        with open(statePath, "r") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+    except Exception:
+        log.exception("Startup State Load")
+        return {}
+
+
+def is_fresh(statePath: str, key: str, maxAge: float) -> bool:
+    """Whether the last successful startup had the same key, within maxAge seconds"""
+    if not maxAge:
+        return False
+    state = load(statePath)
+    if state.get("key") != key:
+        return False
+    return 0 <= time.time() - state.get("time", 0) <= maxAge
+
+
+def store(statePath: str, key: str):
+    """Records a successful startup"""
+    try:
+        with open(statePath + ".tmp", "w") as file:
+            json.dump({"key": key, "time": time.time()}, file, indent=4)
+        os.replace(statePath + ".tmp", statePath)
+    except Exception:
+        log.exception("Startup State Store")
+
+
+def clear(statePath: str):
+    """Forgets the last successful startup, so the next one runs every check"""
+    try:
+        os.remove(statePath)
+    except FileNotFoundError:
+        pass
+    except Exception:
+        log.exception("Startup State Clear")
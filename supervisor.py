@@ -0,0 +1,576 @@
+# MIT APasz
+import asyncio
+import logging
+import os
+import random
+import signal
+import time
+from dataclasses import fields
+from typing import Callable
+
+import capture
+import metrics
+import readiness
+import resources
+import venvs
+
+log = logging.getLogger("TSlog")
+
+
+def should_restart(policy: str, returncode: int | None, restartCode: int) -> bool:
+    """Whether a target that exited with returncode is to be started again.
+    policy is one of config.restartPolicies"""
+    if policy == "always":
+        return True
+    if policy == "failure":
+        return returncode != 0
+    if policy == "restartCode":
+        return returncode == restartCode
+    return False
+
+
+class Backoff:
+    """Paces the restarts of one target. The first restart after a stable run is
+    immediate if intentional (restartCode), else after paceErr. Each further exit before
+    stableUptime doubles the wait, up to restartBackoffMax, jittered"""
+
+    def __init__(self):
+        # Exits in a row before stableUptime
+        self.fast = 0
+        # Of those, the ones that weren't intentional
+        self.failures = 0
+
+    def reset(self):
+        self.fast = 0
+        self.failures = 0
+
+    def delay(
+        self, targetCF, returncode: int | None, uptime: float, paceErr: float
+    ) -> float:
+        """Records an exit, returning seconds to wait before restarting"""
+        if uptime >= targetCF.stableUptime:
+            self.reset()
+        self.fast += 1
+        if returncode == targetCF.restartCode:
+            if self.fast == 1:
+                return 0
+            steps = self.fast - 1
+        else:
+            self.failures += 1
+            steps = self.fast
+        delay = min(paceErr * 2 ** (steps - 1), targetCF.restartBackoffMax)
+        return random.uniform(delay / 2, delay)
+
+    def tripped(self, targetCF) -> bool:
+        """Whether the target has failed rollbackAfter times in a row without a stable run"""
+        return 0 < targetCF.rollbackAfter <= self.failures
+
+
+class Supervisor:
+    """Runs every target as a subprocess at once, restarting each per its own policy.
+    prepare(targetCF, shared) builds a new release in the background, returning its path
+    or None if there's nothing to update. activate(targetCF, releasePath) switches to it.
+    output(targetCF) returns a Capture for the target's stdout/stderr, None to let it inherit ours.
+    check(targetCF, shared) says whether there may be an update, None if it couldn't tell.
+    With a pollInterval, targets are checked that often and updated when check says so.
+    listener is started beside the targets, given trigger_update to call.
+    With updateOnStart, targets are updated as soon as they've been started.
+    watcher.run() is run beside the targets, to reload config.
+    rollback(targetCF) switches a target back to its previous release, when it keeps failing.
+    reject(targetCF, releasePath) records a release that failed to start, so it isn't retried"""
+
+    def __init__(
+        self,
+        targets: list,
+        baseDir: str,
+        paceErr: float,
+        prepare: Callable[[object, dict], str | None] | None = None,
+        activate: Callable[[object, str], bool] | None = None,
+        report: Callable[[], object] | None = None,
+        output: Callable[[object], capture.Capture | None] | None = None,
+        check: Callable[[object, dict], bool | None] | None = None,
+        pollInterval: float = 0,
+        pollBackoffMax: float = 3600,
+        listener=None,
+        watcher=None,
+        updateOnStart: bool = False,
+        rollback: Callable[[object], bool] | None = None,
+        reject: Callable[[object, str], object] | None = None,
+    ):
+        self.targets = targets
+        self.baseDir = baseDir
+        self.paceErr = paceErr
+        self.prepare = prepare
+        self.activate = activate
+        self.report = report
+        self.output = output
+        self.check = check
+        self.pollInterval = pollInterval
+        self.pollBackoffMax = pollBackoffMax
+        self.listener = listener
+        self.watcher = watcher
+        self.updateOnStart = updateOnStart
+        self.rollback = rollback
+        self.reject = reject
+        # {target directory: Backoff}
+        self.backoffs = {}
+        self.poller = None
+        # {target directory: config to switch the target to when it next starts}
+        self.pending = {}
+        self.procs = {}
+        self.started = {}
+        # {pid: (Capture, working directory)}
+        self.captures = {}
+        # {pid: sampling task}
+        self.samplers = {}
+        # {pid: task waiting for it to pass its readiness probes}
+        self.readying = {}
+        self.restarting = set()
+        # Targets whose supervise() is still running
+        self.supervising = set()
+        self.updating = set()
+        # {target directory: new process being readied beside the old one}
+        self.incoming = {}
+        # Targets asked to update while already updating, updated again once that finishes
+        self.queued = set()
+        self.tasks = set()
+        self.stopping = False
+
+    async def spawn(
+        self, targetCF, wd: str | None = None
+    ) -> asyncio.subprocess.Process | None:
+        """Starts the target script, in its target directory unless wd is given"""
+        if targetCF.targetDirectory in self.pending:
+            new = self.pending.pop(targetCF.targetDirectory)
+            for entry in fields(targetCF):
+                setattr(targetCF, entry.name, getattr(new, entry.name))
+            log.info(f"New Config Applied To {targetCF.targetDirectory}")
+        if wd is None:
+            wd = os.path.join(self.baseDir, targetCF.targetDirectory)
+        comm = [venvs.interpreter(wd), targetCF.scriptName]
+        log.debug(f"{targetCF.targetDirectory} | {comm}")
+        output = self.output(targetCF) if self.output is not None else None
+        marker = None
+        if "stdout" in targetCF.readiness and output is not None:
+            marker = output.watch(targetCF.readiness["stdout"])
+        comm = resources.rlimit_command(comm, targetCF.rlimits)
+        st = time.perf_counter()
+        try:
+            if output is None:
+                proc = await asyncio.create_subprocess_exec(*comm, cwd=wd)
+            else:
+                # Unbuffered, so output isn't held back in the pipe or lost on a crash
+                proc = await asyncio.create_subprocess_exec(
+                    *comm,
+                    cwd=wd,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    env=os.environ | {"PYTHONUNBUFFERED": "1"},
+                )
+        except OSError:
+            log.exception(f"Spawn {targetCF.targetDirectory}")
+            return None
+        metrics.record(
+            "spawn",
+            "target",
+            st,
+            time.perf_counter() - st,
+            target=targetCF.targetDirectory,
+        )
+        if output is not None:
+            output.start(proc)
+            self.captures[proc.pid] = (output, wd)
+        if targetCF.sampleInterval:
+            self.samplers[proc.pid] = asyncio.get_running_loop().create_task(
+                self.sample(targetCF, proc)
+            )
+        self.started[proc.pid] = st
+        if targetCF.readiness:
+            self.readying[proc.pid] = asyncio.get_running_loop().create_task(
+                self.await_ready(targetCF, proc, wd, marker, st)
+            )
+        metrics.add("target_launches_total", target=targetCF.targetDirectory)
+        return proc
+
+    async def await_ready(
+        self,
+        targetCF,
+        proc: asyncio.subprocess.Process,
+        wd: str,
+        marker: asyncio.Event | None,
+        st: float,
+    ) -> bool:
+        """Waits for a new process to pass its readiness probes, recording how long it took.
+        One not ready within readyTimeout is stopped, failing the launch"""
+        name = targetCF.targetDirectory
+        elapsed = await readiness.wait(
+            targetCF.readiness,
+            wd=wd,
+            proc=proc,
+            timeout=targetCF.readyTimeout,
+            marker=marker,
+            st=st,
+        )
+        if elapsed is not None:
+            log.info(f"{name} Ready In {elapsed:.2f}s| {proc.pid=}")
+            metrics.gauge("target_ready_seconds", elapsed, target=name)
+            metrics.record("ready", "target", st, elapsed, target=name)
+            metrics.add("target_ready_total", target=name, outcome="ready")
+            return True
+        if proc.returncode is not None:
+            metrics.add("target_ready_total", target=name, outcome="exited")
+            return False
+        log.error(f"{name} Not Ready Within {targetCF.readyTimeout}s, Stopping It")
+        metrics.add("target_ready_total", target=name, outcome="timeout")
+        if not self.stopping:
+            await self.retire(proc)
+        return False
+
+    async def exited(
+        self, targetCF, proc: asyncio.subprocess.Process, crashed: bool = False
+    ):
+        """Records the uptime of a process that has exited, finishes capturing its
+        output, and if it crashed writes a crash report. Returns the uptime"""
+        uptime = time.perf_counter() - self.started.pop(proc.pid, time.perf_counter())
+        name = targetCF.targetDirectory
+        if proc.pid in self.samplers:
+            self.samplers.pop(proc.pid).cancel()
+        if proc.pid in self.readying:
+            self.readying.pop(proc.pid).cancel()
+        if proc.pid in self.captures:
+            output, wd = self.captures.pop(proc.pid)
+            await output.finish()
+            if crashed:
+                reportPath = await asyncio.to_thread(
+                    output.report,
+                    pid=proc.pid,
+                    returncode=proc.returncode,
+                    uptime=uptime,
+                    wd=wd,
+                )
+                log.error(f"Target Crashed {name}| {reportPath=}")
+        metrics.gauge("target_uptime_seconds", uptime, target=name)
+        metrics.add("target_uptime_seconds_total", uptime, target=name)
+        metrics.gauge("target_last_exit_code", proc.returncode, target=name)
+        if self.report is not None:
+            self.report()
+        return uptime
+
+    async def sample(self, targetCF, proc: asyncio.subprocess.Process):
+        """Samples a process's resource use every sampleInterval, restarting it once a
+        threshold in resourceLimits has been exceeded for resourceWindow seconds"""
+        name = targetCF.targetDirectory
+        watch = resources.Watch(targetCF.resourceLimits, targetCF.resourceWindow)
+        while proc.returncode is None and targetCF.sampleInterval:
+            await asyncio.sleep(targetCF.sampleInterval)
+            # Config may have been reloaded since
+            watch.thresholds = targetCF.resourceLimits
+            watch.window = targetCF.resourceWindow
+            current = resources.sample(proc.pid)
+            if current is None:
+                return
+            exceeded = watch.add(current)
+            for key, metric in resources.gaugeNames.items():
+                metrics.gauge(metric, current[key], target=name)
+            if exceeded is None or self.stopping or self.procs.get(name) is not proc:
+                continue
+            log.warning(
+                f"Restarting {name}, {exceeded} Over {targetCF.resourceLimits[exceeded]} "
+                f"For {targetCF.resourceWindow}s| {current=}"
+            )
+            metrics.add("target_resource_restarts_total", target=name, reason=exceeded)
+            self.restarting.add(name)
+            await self.retire(proc)
+            return
+
+    async def supervise(self, targetCF) -> int | None:
+        """Runs a target until its restart policy says to stop. Returns last exit code"""
+        name = targetCF.targetDirectory
+        backoff = self.backoffs.setdefault(name, Backoff())
+        # A crash the policy doesn't restart rolls back once, not from release to release
+        rolledBack = False
+        self.supervising.add(name)
+        try:
+            while True:
+                proc = self.procs.get(name)
+                if proc is None:
+                    log.info(f"Triggering Target Script {name}")
+                    proc = await self.spawn(targetCF)
+                uptime = 0
+                if proc is None:
+                    returncode = None
+                else:
+                    self.procs[name] = proc
+                    returncode = await proc.wait()
+                    replaced = self.procs.get(name) is not proc
+                    expected = replaced or self.stopping or name in self.restarting
+                    uptime = await self.exited(
+                        targetCF,
+                        proc,
+                        crashed=not expected
+                        and returncode not in (0, targetCF.restartCode),
+                    )
+                    if replaced:
+                        log.info(f"Old Process Of {name} Exited| {returncode=}")
+                        continue
+                    del self.procs[name]
+                if name in self.restarting:
+                    self.restarting.discard(name)
+                    continue
+                log.warning(f"Target Exited {name}| {returncode=}")
+                if self.stopping:
+                    return returncode
+                if not should_restart(
+                    policy=targetCF.restartPolicy,
+                    returncode=returncode,
+                    restartCode=targetCF.restartCode,
+                ):
+                    # Not restarted, so it can't crash rollbackAfter times in a row. One crash
+                    # before stableUptime is enough to roll back and start the previous release
+                    crashed = returncode not in (0, targetCF.restartCode)
+                    if (
+                        not crashed
+                        or rolledBack
+                        or uptime >= targetCF.stableUptime
+                        or targetCF.rollbackAfter == 0
+                        or name in self.updating
+                        or not await self.roll_back(targetCF, backoff.failures + 1)
+                    ):
+                        return returncode
+                    rolledBack = True
+                    backoff.reset()
+                    continue
+                metrics.add("target_restarts_total", target=name)
+                delay = backoff.delay(targetCF, returncode, uptime, self.paceErr)
+                if backoff.tripped(targetCF) and name not in self.updating:
+                    if await self.roll_back(targetCF, backoff.failures):
+                        backoff.reset()
+                        delay = 0
+                metrics.gauge("target_restart_delay_seconds", delay, target=name)
+                if delay:
+                    log.info(f"Restarting {name} In {delay:.1f}s| {backoff.fast=}")
+                    await asyncio.sleep(delay)
+                if self.stopping:
+                    return returncode
+        finally:
+            self.supervising.discard(name)
+
+    async def roll_back(self, targetCF, failures: int) -> bool:
+        """Switches a target that keeps failing back to its previous release"""
+        name = targetCF.targetDirectory
+        if self.rollback is None:
+            return False
+        log.error(f"{name} Failed {failures} Times In A Row, Rolling Back")
+        if not await asyncio.to_thread(self.rollback, targetCF):
+            log.error(f"Unable To Roll Back {name}")
+            metrics.add("target_rollbacks_total", target=name, outcome="failed")
+            return False
+        metrics.add("target_rollbacks_total", target=name, outcome="rolledBack")
+        return True
+
+    async def ready(self, proc: asyncio.subprocess.Process, targetCF) -> bool:
+        """Whether a new process passed its readiness probes, or without any, whether
+        it's still running once readyTimeout has passed"""
+        if proc.pid in self.readying:
+            return await self.readying[proc.pid]
+        try:
+            returncode = await asyncio.wait_for(
+                proc.wait(), timeout=targetCF.readyTimeout
+            )
+        except asyncio.TimeoutError:
+            return True
+        log.error(f"New Process Exited Before Ready| {returncode=}")
+        return False
+
+    async def retire(self, proc: asyncio.subprocess.Process):
+        """Asks a process to exit, killing it if it hasn't after paceErr * 10"""
+        try:
+            proc.terminate()
+            await asyncio.wait_for(proc.wait(), timeout=self.paceErr * 10)
+        except ProcessLookupError:
+            pass
+        except asyncio.TimeoutError:
+            log.warning(f"Killing {proc.pid=}")
+            proc.kill()
+            await proc.wait()
+
+    async def update(self, targetCF, shared: dict) -> bool:
+        """Prepares a new release while the target keeps running, then swaps to it.
+        With blueGreen the new process must be ready before the old one is told to exit"""
+        name = targetCF.targetDirectory
+        if self.prepare is None:
+            return False
+        if name in self.updating:
+            self.queued.add(name)
+            return False
+        self.updating.add(name)
+        try:
+            log.info(f"Preparing Update Of {name}")
+            releasePath = await asyncio.to_thread(self.prepare, targetCF, shared)
+            if releasePath is None:
+                log.info(f"No Update For {name}")
+                return False
+            if self.stopping or name not in self.procs:
+                return await asyncio.to_thread(self.activate, targetCF, releasePath)
+            if not targetCF.blueGreen:
+                if not await asyncio.to_thread(self.activate, targetCF, releasePath):
+                    return False
+                self.restarting.add(name)
+                await self.retire(self.procs[name])
+                return True
+            log.info(f"Starting New Release Of {name} Beside The Old")
+            new = await self.spawn(targetCF, wd=releasePath)
+            if new is None:
+                log.error(f"New Release Of {name} Failed, Keeping Old")
+                return False
+            self.incoming[name] = new
+            if not await self.ready(new, targetCF):
+                log.error(f"New Release Of {name} Failed, Keeping Old")
+                await self.exited(targetCF, new, crashed=True)
+                if self.reject is not None and not self.stopping:
+                    await asyncio.to_thread(self.reject, targetCF, releasePath)
+                return False
+            # Stopped, or the old process exited for good, while the new one readied
+            if self.stopping or name not in self.supervising:
+                log.info(f"{name} Stopped While Readying, Stopping New Release")
+                await self.retire(new)
+                await self.exited(targetCF, new)
+                return await asyncio.to_thread(self.activate, targetCF, releasePath)
+            if not await asyncio.to_thread(self.activate, targetCF, releasePath):
+                await self.retire(new)
+                await self.exited(targetCF, new)
+                return False
+            old = self.procs.get(name)
+            self.procs[name] = new
+            if old is not None:
+                await self.retire(old)
+            log.info(f"Swapped {name} To New Release")
+            return True
+        finally:
+            new = self.incoming.pop(name, None)
+            # Never left running without supervise() awaiting it, even when cancelled
+            if (
+                new is not None
+                and new.returncode is None
+                and self.procs.get(name) is not new
+            ):
+                await self.retire(new)
+            self.updating.discard(name)
+            if name in self.queued and not self.stopping:
+                self.queued.discard(name)
+                self.trigger_update([targetCF])
+
+    async def update_all(self, targets: list | None = None) -> list[bool]:
+        """Updates targets, default all, sharing work between targets with identical inputs"""
+        shared = {}
+        return await asyncio.gather(
+            *(self.update(targetCF, shared) for targetCF in targets or self.targets)
+        )
+
+    def poll_delay(self, failures: int) -> float:
+        """Seconds until the next check, doubling per failed check up to pollBackoffMax.
+        Jittered so hosts sharing a repository don't all check at once"""
+        if not failures:
+            return random.uniform(self.pollInterval * 0.9, self.pollInterval * 1.1)
+        delay = min(self.pollInterval * 2**failures, self.pollBackoffMax)
+        return random.uniform(delay / 2, delay)
+
+    async def poll(self):
+        """Checks every target on an interval, updating those with something new"""
+        failures = 0
+        while not self.stopping:
+            await asyncio.sleep(self.poll_delay(failures))
+            if self.stopping:
+                return
+            shared = {}
+            found = await asyncio.gather(
+                *(
+                    asyncio.to_thread(self.check, targetCF, shared)
+                    for targetCF in self.targets
+                )
+            )
+            if any(result is None for result in found):
+                failures += 1
+                metrics.add("poll_checks_total", outcome="failed")
+                log.warning(f"Update Check Failed, {failures=}")
+            else:
+                failures = 0
+                metrics.add("poll_checks_total", outcome="ok")
+            pending = [
+                targetCF for targetCF, result in zip(self.targets, found) if result
+            ]
+            if pending:
+                log.info(f"Update Found For {len(pending)} Target(s)")
+                await asyncio.gather(
+                    *(self.update(targetCF, shared) for targetCF in pending)
+                )
+
+    def configure_poll(self, pollInterval: float, pollBackoffMax: float):
+        """Sets how often to check for updates, starting or stopping checks as needed"""
+        self.pollInterval = pollInterval
+        self.pollBackoffMax = pollBackoffMax
+        wanted = self.prepare is not None and self.check is not None and pollInterval
+        if wanted and self.poller is None:
+            self.poller = asyncio.get_running_loop().create_task(self.poll())
+        elif not wanted and self.poller is not None:
+            self.poller.cancel()
+            self.poller = None
+
+    def trigger_update(self, targets: list | None = None):
+        """Starts updating targets, default all, in the background"""
+        task = asyncio.get_running_loop().create_task(self.update_all(targets))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def stop(self):
+        """Stops restarting targets and asks running ones to exit"""
+        log.info("Stopping Targets")
+        self.stopping = True
+        for proc in [*self.procs.values(), *self.incoming.values()]:
+            try:
+                proc.terminate()
+            except ProcessLookupError:
+                pass
+
+    async def run(self) -> dict[str, int | None]:
+        """Supervises every target. Returns {target directory: last exit code}"""
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError):
+                pass
+        if self.prepare is not None and hasattr(signal, "SIGHUP"):
+            loop.add_signal_handler(signal.SIGHUP, self.trigger_update)
+        if self.prepare is not None and self.listener is not None:
+            try:
+                await self.listener.start(self.trigger_update)
+            except OSError:
+                log.exception("Webhook Listener Start")
+                self.listener = None
+        self.configure_poll(self.pollInterval, self.pollBackoffMax)
+        if self.prepare is not None and self.updateOnStart:
+            self.trigger_update()
+        watching = None
+        if self.watcher is not None:
+            watching = loop.create_task(self.watcher.run())
+        returncodes = await asyncio.gather(
+            *(self.supervise(targetCF) for targetCF in self.targets)
+        )
+        self.configure_poll(0, self.pollBackoffMax)
+        # Updates still running are cancelled, stopping any new process they started
+        for task in list(self.tasks):
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        if watching is not None:
+            watching.cancel()
+        if self.listener is not None:
+            await self.listener.stop()
+        return {
+            targetCF.targetDirectory: returncode
+            for targetCF, returncode in zip(self.targets, returncodes)
+        }
+
+    def start(self) -> dict[str, int | None]:
+        """Runs the supervisor until every target has stopped"""
+        return asyncio.run(self.run())
@@ -0,0 +1,6 @@
+# MIT APasz
+import os
+import sys
+
+# The modules sit flat beside triggerScript.py, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,114 @@
+# MIT APasz
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import subprocess
+import tempfile
+import unittest
+import urllib.error
+import urllib.request
+
+import webhook
+from triggerConfig import TARGET
+
+secret = "hush"
+
+
+def sign(body: bytes, key: str = secret) -> str:
+    return "sha256=" + hmac.new(key.encode(), body, hashlib.sha256).hexdigest()
+
+
+def post(port: int, body: bytes, headers: dict) -> tuple[int, dict]:
+    """Posts body to the listener, returning the status and JSON reply"""
+    request = urllib.request.Request(
+        f"http://127.0.0.1:{port}/", data=body, headers=headers, method="POST"
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=5) as resp:
+            return resp.status, json.load(resp)
+    except urllib.error.HTTPError as xcp:
+        return xcp.code, json.load(xcp)
+
+
+def push(repository: str, ref: str = "refs/heads/main") -> bytes:
+    return json.dumps(
+        {
+            "ref": ref,
+            "repository": {"clone_url": repository, "default_branch": "main"},
+        }
+    ).encode()
+
+
+class ListenerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.remote = os.path.join(self.folder.name, "remote.git")
+        subprocess.run(["git", "init", "-q", "--bare", self.remote], check=True)
+        self.target = TARGET(repository=self.remote, targetDirectory="active")
+        self.other = TARGET(
+            repository="someone/else", targetDirectory="other", releaseDirectory="o"
+        )
+        self.triggered = []
+        self.listener = webhook.Listener(
+            address="127.0.0.1:0",
+            secret=secret,
+            targets=[self.target, self.other],
+            debounce=0.2,
+        )
+        await self.listener.start(self.triggered.append)
+        self.port = self.listener.server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        await self.listener.stop()
+        self.folder.cleanup()
+
+    async def send(
+        self, body: bytes, event: str = "push", signature: str | None = None
+    ):
+        headers = {
+            "X-GitHub-Event": event,
+            "X-Hub-Signature-256": sign(body) if signature is None else signature,
+        }
+        return await asyncio.to_thread(post, self.port, body, headers)
+
+    async def test_rejects_bad_signature(self):
+        body = push(self.remote)
+        status, _ = await self.send(body, signature=sign(body, key="wrong"))
+        self.assertEqual(status, 401)
+        status, _ = await self.send(body, signature="")
+        self.assertEqual(status, 401)
+        await asyncio.sleep(0.3)
+        self.assertEqual(self.triggered, [])
+
+    async def test_ping(self):
+        status, reply = await self.send(b"{}", event="ping")
+        self.assertEqual((status, reply), (200, {"pong": True}))
+
+    async def test_matches_local_remote_only(self):
+        status, reply = await self.send(push(self.remote + "/"))
+        self.assertEqual((status, reply), (202, {"targets": ["active"]}))
+        status, reply = await self.send(push("/elsewhere/repo.git"))
+        self.assertEqual((status, reply), (202, {"targets": []}))
+        status, reply = await self.send(push(self.remote, ref="refs/heads/dev"))
+        self.assertEqual((status, reply), (202, {"ignored": "refs/heads/dev"}))
+        await asyncio.sleep(0.3)
+        self.assertEqual(self.triggered, [[self.target]])
+
+    async def test_debounces_pushes(self):
+        for _ in range(3):
+            status, _ = await self.send(push(self.remote))
+            self.assertEqual(status, 202)
+        self.assertEqual(self.triggered, [])
+        await asyncio.sleep(0.3)
+        self.assertEqual(self.triggered, [[self.target]])
+
+    async def test_rejects_payload_not_an_object(self):
+        for body in (b"[1, 2]", b'"x"', b'{"repository": [1]}'):
+            status, _ = await self.send(body)
+            self.assertEqual(status, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
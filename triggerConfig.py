@@ -1,4 +1,4 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 
 @dataclass(slots=True)
@@ -7,37 +7,116 @@ class TARGET:
 
     # Name of target script
     # Default = "bot.py"
-    scriptName = "bot.py"
+    scriptName: str = "bot.py"
     # Name of requirements file for target (if not needed, arg = False)
     # Default = "requirements.txt"
-    requiredModules = "requirements.txt"
+    requiredModules: str | bool = "requirements.txt"
     # Names of the required files for target. If Github is enabled, will copy these over when updating
     # Default = ["config.py", "config.json"]
-    requiredFiles = ["config.py", "config.json"]
+    requiredFiles: list[str] = field(
+        default_factory=lambda: ["config.py", "config.json"]
+    )
     # Names of the required folders for target. If Github is enabled, will copy these over when updating
     # Default = ["secrets"]
-    requiredFolders = ["secrets"]
+    requiredFolders: list[str] = field(default_factory=lambda: ["secrets"])
+    # Hardlink required files into a new release rather than copying them, where the filesystem allows.
+    # Only safe if the script replaces files rather than writing into them, as both releases share them
+    # Default = False
+    hardlinkRequired: bool = False
     # Github username/repo
     # (SSCBot | Strider)
     # Default = "APasz/Strider"
-    repository = "APasz/Strider"
+    repository: str = "APasz/Strider"
     # Folder that the target script itself is in. The one that'll be run.
+    # If Github is enabled, this is a link to the current folder in releaseDirectory
     # Default = "active"
-    targetDirectory = "active"
-    # Folder that old versions will be stored
+    targetDirectory: str = "active"
+    # Folder that each downloaded version is kept in, one folder per commit
+    # Default = "releases"
+    releaseDirectory: str = "releases"
+    # Number of releases to keep in releaseDirectory for instant rollback. Older ones are only archived
+    # Default = 3
+    releaseKeep: int = 3
+    # Folder that old versions will be stored. Files are deduplicated and compressed
     # Default = "archive"
-    archiveDirectory = "archive"
-    # Addresses to ping to ensure the target script can start
+    archiveDirectory: str = "archive"
+    # Number of archived versions to keep
+    # Default = 20
+    archiveKeep: int = 20
+    # Days an archived version is kept for. The newest one is always kept
+    # Default = 90
+    archiveMaxAge: float = 90
+    # Only fetch this many commits of history into the local mirror (None = full history)
+    # Useful for large repositories
+    # Default = None
+    gitDepth: int | None = None
+    # Addresses to probe to ensure the target script can start ("host" or "host:port")
     # Default = {"Discord": "www.discord.com"}
-    network = {"Discord": "www.discord.com"}
+    network: dict[str, str] | None = field(
+        default_factory=lambda: {"Discord": "www.discord.com"}
+    )
     # Check version before replace
     # (only compatible with scripts that have a changelog.json in root where the keys are the version,
     # like in the changelog.json bundled with this script)
     # Default = True
-    checkVersion = True
+    checkVersion: bool = True
     # Code script will output when restart is intended
     # Default = 94
-    restartCode = 94
+    restartCode: int = 94
+    # When to start the script again after it exits
+    # ("always", "failure" = restartCode or any non-zero code, "restartCode", "never")
+    # Default = "restartCode"
+    restartPolicy: str = "restartCode"
+    # Seconds the script must run to count as stable, restarts before then back off and count
+    # towards rollbackAfter
+    # Default = 60
+    stableUptime: float = 60
+    # Most seconds to wait before restarting a script that keeps exiting, backing off from paceErr
+    # Default = 300
+    restartBackoffMax: float = 300
+    # Switch back to the previous release once the script has crashed this many times in a row
+    # without running for stableUptime. If restartPolicy doesn't restart it after a crash, one
+    # crash before stableUptime is enough. The release rolled back from isn't deployed again.
+    # 0 to never roll back
+    # Default = 5
+    rollbackAfter: int = 5
+    # When updating while running (SIGHUP), start the new release beside the old one and only
+    # stop the old one once the new one is ready. A new release that doesn't get ready isn't
+    # tried again until remote HEAD moves on. If False, the old one is stopped first
+    # Default = True
+    blueGreen: bool = True
+    # Probes the script must all pass once started to count as ready, time taken is recorded
+    # tcp: "host:port" accepting connections | file: path (from the script's folder) existing
+    # stdout: marker written to stdout (needs outputDirectory) | http: URL answering 2xx/3xx
+    # e.g. {"tcp": "127.0.0.1:8080", "stdout": "Logged in as"}
+    # Default = {}
+    readiness: dict[str, str] = field(default_factory=dict)
+    # Seconds a started script has to pass its readiness probes, else it's stopped and counts
+    # as a failed launch. Without probes, seconds a new release must stay running to be ready
+    # Default = 10
+    readyTimeout: float = 10
+    # Seconds between samples of the script's memory, CPU, open files and threads (from /proc)
+    # Samples are exported with the run metrics. 0 to disable
+    # Default = 10
+    sampleInterval: float = 10
+    # Restart the script once any of these is exceeded in every sample for resourceWindow seconds
+    # rss: MiB | cpu: percent of a core | fds: open files | threads. e.g. {"rss": 512, "cpu": 95}
+    # Default = {}
+    resourceLimits: dict[str, float] = field(default_factory=dict)
+    # Seconds a resourceLimits threshold must stay exceeded before restarting
+    # Default = 300
+    resourceWindow: float = 300
+    # Hard limits applied to the script when started, by resource name
+    # e.g. {"NOFILE": 4096, "AS": 2147483648 (bytes of address space), "CORE": 0}
+    # Default = {}
+    rlimits: dict[str, int] = field(default_factory=dict)
+    # Folder the script's stdout/stderr is logged to, as <targetDirectory>.log, rotated like TSlog.log
+    # Crash reports holding the last of its output are written here too. None to print it with ours
+    # Default = "logs"
+    outputDirectory: str | None = "logs"
+    # KiB of the latest output kept in memory for crash reports, 0 to keep none
+    # Default = 64
+    outputBuffer: int = 64
 
 
 @dataclass(slots=True)
@@ -46,38 +125,134 @@ class CORE:
 
     # Name of requirements file for self
     # Default = "requirements.txt"
-    requiredModules = "requirements.txt"
+    requiredModules: str | bool = "requirements.txt"
     # "DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL", "FATAL"
     # Case insensitive
     # Default = "INFO"
-    logLevel = "DEBUG"
+    logLevel: str = "DEBUG"
+    # Size in bytes TSlog.log may grow to before it's rotated, 0 for no limit
+    # Default = 5242880 (5MiB)
+    logMaxBytes: int = 5242880
+    # Age in days TSlog.log may reach before it's rotated, 0 for no limit
+    # Default = 7
+    logMaxAge: float = 7
+    # Number of rotated logs to keep, gzipped as TSlog.log.1.gz etc. 0 disables rotation
+    # Default = 5
+    logBackups: int = 5
+    # Seconds the last successful startup's checks are trusted for. If the config, interpreter,
+    # target folders and deployed commits haven't changed since, targets are launched at once
+    # and checked in the background, updates are then deployed while they run. 0 to disable
+    # Default = 86400
+    fastStartMaxAge: float = 86400
     # Enable fetching from GitHub. If False, archiving is disabled. Will only start the target script.
     # Default = True
-    gitHub = True
+    gitHub: bool = True
+    # Folder that bare mirrors of target repositories are kept in, to be updated by fetching
+    # Default = "mirrors"
+    mirrorDirectory: str = "mirrors"
     # Number of times to retry doing anything before quiting
     # Default = 3
-    retry = 3
+    retry: int = 3
     # Whether to check if the required packages are installed
     # Default = True
-    checkRequiredPackages = True
+    checkRequiredPackages: bool = True
+    # Folder each release's requirements are installed to, as a venv shared by releases with the
+    # same requirements, so they're installed ahead of the switch rather than before launch.
+    # None to install into this script's interpreter instead
+    # Default = "venvs"
+    venvDirectory: str | None = "venvs"
+    # Folder of wheels venvs are installed from, offline. Only what's missing is downloaded
+    # Default = "wheelhouse"
+    wheelDirectory: str = "wheelhouse"
     # Whether to actually start the target script
     # Default = True
-    launchTarget = True
+    launchTarget: bool = True
     # When target script version is archived, this separator + timestamp will be appended
     # Default = ";"
-    folderSeperator = ";"
-    # Time in milliseconds give to ensure certain actions actually happen before the script proceeds
+    folderSeperator: str = ";"
+    # Folder to write run metrics to (Prometheus textfile metrics.prom + summary.json), None to disable
+    # Written after startup, whenever a target exits and at the end
+    # Default = "metrics"
+    metricsDirectory: str | None = "metrics"
+    # Also write a Chrome trace (trace.json) of the run, viewable in chrome://tracing or Perfetto
+    # Only the latest 10000 spans are kept for it, totals count every one
+    # Default = False
+    metricsTrace: bool = False
+    # Seconds between checks of each repository for a new commit while targets run, 0 to only
+    # check at start. Only the remote HEAD is read, so a check costs the same for any repository
+    # Default = 0
+    pollInterval: float = 0
+    # Most seconds to wait between checks while they're failing, backing off from pollInterval
+    # Default = 3600
+    pollBackoffMax: float = 3600
+    # "host:port" to listen on for Github push webhooks, which update the matching targets at once
+    # None to disable. Set the webhook's content type to application/json
+    # Default = None
+    webhookAddress: str | None = None
+    # Secret the webhook is signed with, requests not signed with it are refused. Required
+    # Default = None
+    webhookSecret: str | None = None
+    # Seconds to wait after a push for any more before updating, so a burst deploys once
+    # Default = 5
+    webhookDebounce: float = 5
+    # Deprecated, no longer read. Was time in milliseconds given to ensure certain actions
+    # happened before the script proceeded. Kept so configs that set it still load
     # Default = 75
-    paceNorm = 75
+    paceNorm: float = 75
     # Time in seconds to give when an error occurs with certain actions before the script tries again
     # Default = 3
-    paceErr = 3
+    paceErr: float = 3
     # Address for the LAN gateway
     # Default = None
-    gateway = None
-    # Addresses to ping to ensure those services can be reached, if enabled
+    gateway: str | None = None
+    # Addresses to probe to ensure those services can be reached, if enabled ("host" or "host:port")
     # Default = {"Github": "www.github.com", "PyPi": "www.pypi.org"}
-    network = {"PyPi": "www.pypi.org"}
+    network: dict[str, str] | None = field(
+        default_factory=lambda: {"PyPi": "www.pypi.org"}
+    )
+    # Port used when probing network addresses that don't specify their own ("host:port")
+    # Default = 443
+    probePort: int = 443
+    # Time in seconds each network probe is given to connect before it counts as a failure
+    # Default = 3
+    probeTimeout: float = 3
+    # Seconds a successful gateway ping / network probe is remembered (in netcache.json), so
+    # restarts within it skip probing. Forgotten early if network interfaces or routes change
+    # 0 to always probe
+    # Default = 300
+    probeCacheTTL: float = 300
+
+
+# Scripts to trigger, all run at once. To run several, add a TARGET with what differs,
+# each needs its own targetDirectory, releaseDirectory and archiveDirectory
+#
+# TARGETS = [
+#     TARGET(),
+#     TARGET(
+#         repository="APasz/SSCBot",
+#         targetDirectory="otherActive",
+#         releaseDirectory="otherReleases",
+#         archiveDirectory="otherArchive",
+#     ),
+# ]
+#
+# Default = [TARGET()]
+TARGETS = [TARGET()]
+
+# Instead of editing this file, everything above can be set in triggerConfig.toml (or .json) beside
+# it, which is watched and reloaded while running. Anything not set there keeps its default here
+#
+# [core]
+# logLevel = "INFO"
+# pollInterval = 300
+#
+# [[targets]]
+# repository = "APasz/Strider"
+#
+# [[targets]]
+# repository = "APasz/SSCBot"
+# targetDirectory = "otherActive"
+# releaseDirectory = "otherReleases"
 
 
 # MIT APasz
@@ -1,107 +1,150 @@
 #!/usr/bin/env python3
+import argparse
+import importlib.util
 import json
 import logging
 import os
 import platform
 import subprocess
 import sys
+import threading
 import time
 from datetime import datetime as datetime
+from functools import partial
 
-
+import config
+import logqueue
+import metrics
 import util
+from triggerConfig import CORE, TARGETS
 
 pajoin = os.path.join
 
-PID = os.getpid()
-print(f"*** Starting ***\nPID: {PID}")
-
-
 logINIT = 5
 scriptName = (os.path.basename(__file__)).removesuffix(".py")
 log = logging.getLogger("TSlog")
-logging.addLevelName(logging.DEBUG, "DBUG")
-
-handleConsole = logging.StreamHandler(sys.stdout)
-handleConsole.setFormatter(
-    logging.Formatter("%(asctime)s |:| %(funcName)s | %(message)s", "%H:%M:%S")
-)
-handleConsole.setLevel(logINIT)
-log.addHandler(handleConsole)
-
-
 curDir = os.path.dirname(os.path.realpath(__file__))
 
-handleFile = logging.FileHandler(
-    filename=pajoin(curDir, "TSlog.log"),
-    encoding="utf-8",
-    mode="a",
-)
-handleFile.setFormatter(
-    logging.Formatter(
-        "%(asctime).19s %(created).2f | %(levelname).4s |:| %(funcName)s | %(message)s",
+# Set by setup()
+handleConsole = None
+handleFile = None
+configPath = None
+coreCF = None
+targetsCF = []
+# Set by launch()
+targetSuper = None
+
+
+def setupLogging(consoleLevel: int = logINIT):
+    """Adds the console and TSlog.log handlers, once"""
+    global handleConsole, handleFile
+    if handleFile is not None:
+        return
+    logging.addLevelName(logging.DEBUG, "DBUG")
+    handleConsole = logging.StreamHandler(sys.stdout)
+    handleConsole.setFormatter(
+        logging.Formatter("%(asctime)s |:| %(funcName)s | %(message)s", "%H:%M:%S")
     )
-)
-handleFile.setLevel(logINIT)
-log.addHandler(handleFile)
-
-try:
-    log.info("TRY MODULE IMPORT")
-    from packaging import version
-    import netifaces
-
-    from triggerConfig import CORE as coreCF
-    from triggerConfig import TARGET as targetCF
-except Exception:
-    log.exception("IMPORT FAILED")
+    handleConsole.setLevel(consoleLevel)
+    log.addHandler(handleConsole)
+    handleFile = logqueue.CompressingFileHandler(filename=pajoin(curDir, "TSlog.log"))
+    handleFile.setFormatter(
+        logging.Formatter(
+            "%(asctime).19s %(created).2f | %(levelname).4s |:| %(funcName)s | %(message)s",
+        )
+    )
+    handleFile.setLevel(logINIT)
+    log.addHandler(handleFile)
+
+
+def loadConfig(itemPath: str | None = None) -> bool:
+    """Loads the config file beside this script (or itemPath), else triggerConfig.py"""
+    global configPath, coreCF, targetsCF
+    configPath = itemPath or config.find(curDir)
+    if configPath is None:
+        core, targets = CORE(), TARGETS
+        configProblems = config.validate(core, targets)
+        for problem in configProblems:
+            log.critical(f"triggerConfig.py {problem}")
+        if configProblems:
+            return False
+    else:
+        loaded = config.load(configPath)
+        if loaded is None:
+            log.critical(f"Invalid Config {configPath=}")
+            return False
+        core, targets = loaded
+    coreCF, targetsCF = core, targets
+    return True
 
 
-if version.parse(platform.python_version()) <= version.parse("3.10.0"):
-    log.fatal("Python 3.10.0 or greater is required!")
-    exit()
+def setup(itemPath: str | None = None, consoleLevel: int = logINIT) -> bool:
+    """Sets up logging and loads the config, everything else here needs this first"""
+    setupLogging(consoleLevel=consoleLevel)
+    if sys.version_info < (3, 10):
+        log.fatal("Python 3.10.0 or greater is required!")
+        return False
+    if not loadConfig(itemPath):
+        return False
+    handleFile.limit(
+        maxBytes=coreCF.logMaxBytes,
+        backupCount=coreCF.logBackups,
+        maxAge=coreCF.logMaxAge * 86400,
+    )
+    logqueue.start(log=log, handlers=[handleConsole, handleFile])
+    log.setLevel(coreCF.logLevel.upper())
+    return True
 
 
-tarDir = pajoin(curDir, targetCF.targetDirectory)
-log.setLevel("DEBUG")
-log.critical(
-    f"""Starting...
-    PID: {PID}
+def banner():
+    log.critical(
+        f"""Starting...
+    PID: {os.getpid()}
     Platform: {platform.system()} | {platform.node()}
     Python: {platform.python_version()}
     Current Directory: {curDir}
     Current Working: {os.getcwd()}
-    Target Directory: {tarDir}"""
-)
+    Target Directories: {", ".join(t.targetDirectory for t in targetsCF)}"""
+    )
 
 
 def run_comm(name: str, comm: list, wd: str | None = None, nullOut: bool = False):
     log.debug(f"{name} | {comm}")
+    st = time.perf_counter()
+    returncode = None
     try:
         if nullOut:
             commReturn = subprocess.run(
                 comm, cwd=wd, stdout=subprocess.DEVNULL, check=True
             )
-            log.debug(commReturn.returncode)
-            return True
         else:
             commReturn = subprocess.run(comm, cwd=wd, check=True)
-            log.debug(commReturn.returncode)
-            return True
-    except subprocess.CalledProcessError:
+        returncode = commReturn.returncode
+        log.debug(returncode)
+        return True
+    except subprocess.CalledProcessError as xcp:
+        returncode = xcp.returncode
         log.exception(f"subprocess.run ERR | {name}")
         return False
+    finally:
+        metrics.record(
+            name, "command", st, time.perf_counter() - st, returncode=returncode
+        )
+
+
+def targetDirs(targetCF) -> tuple[str, str, str]:
+    """Returns the target, release and archive directories of a target"""
+    return (
+        pajoin(curDir, targetCF.targetDirectory),
+        pajoin(curDir, targetCF.releaseDirectory),
+        pajoin(curDir, targetCF.archiveDirectory),
+    )
 
 
-def basicChecks():
-    """Checks to ensure required core/target files are present"""
+def targetChecks(targetCF) -> bool:
+    """Checks to ensure required target files are present"""
     ok = True
-    log.info("Checking For Core Requirements File")
-    if util.check_exist(itemPath=pajoin(curDir, coreCF.requiredModules), isFile=True):
-        log.info(f"Core {coreCF.requiredModules}: Found")
-    else:
-        log.error(f"Core {coreCF.requiredModules=}: Missing!")
-        ok = False
-
+    tarDir, _, arcDir = targetDirs(targetCF)
     log.info("Checking For Target Directory")
     if util.check_exist(itemPath=tarDir, isFile=False):
         log.info(f"Target Directory {targetCF.targetDirectory}: Found")
@@ -111,16 +154,12 @@ def basicChecks():
             log.info(f"Target Directory {targetCF.targetDirectory}: Made")
 
     log.info("Checking For Archive Directory")
-    if util.check_exist(
-        itemPath=pajoin(curDir, targetCF.archiveDirectory), isFile=False
-    ):
+    if util.check_exist(itemPath=arcDir, isFile=False):
         log.info(f"Archive Directory {targetCF.archiveDirectory}: Found")
     else:
         log.error(f"Archive Directory {targetCF.archiveDirectory=}: Missing!")
-        if util.make_thing(
-            itemPath=pajoin(curDir, targetCF.archiveDirectory), isFile=False
-        ):
-            log.info(f"Target Directory {targetCF.targetDirectory}: Made")
+        if util.make_thing(itemPath=arcDir, isFile=False):
+            log.info(f"Archive Directory {targetCF.archiveDirectory}: Made")
 
     log.info("Checking For Target Script")
     if util.check_exist(itemPath=pajoin(tarDir, targetCF.scriptName), isFile=True):
@@ -134,9 +173,9 @@ def basicChecks():
         if util.check_exist(
             itemPath=pajoin(tarDir, targetCF.requiredModules), isFile=True
         ):
-            log.info(f"Target {targetCF.requiredFiles}: Found")
+            log.info(f"Target {targetCF.requiredModules}: Found")
         else:
-            log.error(f"Target {targetCF.requiredFiles=}: Missing!")
+            log.error(f"Target {targetCF.requiredModules=}: Missing!")
             ok = False
 
     if len(targetCF.requiredFiles) > 0:
@@ -155,9 +194,28 @@ def basicChecks():
                 log.error(f"Target Required Folder {element}: Missing!")
                 if util.make_thing(itemPath=pajoin(tarDir, element), isFile=False):
                     log.info(f"Target Required Folder {element}: Made")
+    return ok
+
+
+def basicChecks():
+    """Checks to ensure required core/target files are present"""
+    ok = True
+    log.info("Checking For Core Requirements File")
+    if util.check_exist(itemPath=pajoin(curDir, coreCF.requiredModules), isFile=True):
+        log.info(f"Core {coreCF.requiredModules}: Found")
+    else:
+        log.error(f"Core {coreCF.requiredModules=}: Missing!")
+        ok = False
+
+    for targetCF in targetsCF:
+        log.info(f"Checking Target {targetCF.targetDirectory}")
+        if not targetChecks(targetCF):
+            ok = False
 
     log.info("Ensuring PiP")
-    if run_comm(name="Ensure pip", comm=["python", "-m", "ensurepip", "--upgrade"]):
+    if importlib.util.find_spec("pip") is not None:
+        log.info("PiP Found")
+    elif run_comm(name="Ensure pip", comm=[sys.executable, "-m", "ensurepip"]):
         log.info("PiP Ensured")
     else:
         log.error("Unable To Ensure PiP")
@@ -165,18 +223,15 @@ def basicChecks():
     return ok
 
 
-log.info("Performing Basic Checks...")
-if basicChecks():
-    log.info("Basic Checks Successful")
-else:
-    log.fatal("Basic Checks Failed!")
-    exit()
-
-
 sysFolded = (platform.system()).casefold()
+netResults = {}
+netLocks = {}
 
 
-def networkChecks(core: bool):
+def networkChecks(core: bool, targetCF=None) -> dict[str, float | None]:
+    """Probes gateway, then all core/target addresses at once. Returns {name: ms or None}"""
+    import probe
+
     log.debug("run")
     if sysFolded == "windows":
         pingType = "-n"
@@ -185,16 +240,25 @@ def networkChecks(core: bool):
 
     def ping(host):
         if host is None:
-            host = netifaces.gateways()["default"][netifaces.AF_INET][0]
+            host = probe.default_gateway()
+            if host is None:
+                log.error("No Default Gateway Found")
         if host:
             return run_comm(name="ping", comm=["ping", pingType, "1", host])
 
+    cachePath = pajoin(curDir, "netcache.json")
+    ttl = coreCF.probeCacheTTL
+    gwKey = f"gateway {coreCF.gateway}"
+    gatewayCached = core and probe.cached(cachePath, gwKey, ttl) is not None
+    if gatewayCached:
+        log.info("Gateway Reached Recently, Skipping Ping")
     retryMax = coreCF.retry + 1
     retryCount = 0
-    while True and core is True:
+    while True and core is True and not gatewayCached:
         log.info("Pinging Gateway")
         if ping(host=coreCF.gateway):
             log.info("Gateway Ping Successful")
+            probe.remember(cachePath, gwKey, {})
             break
         else:
             retryCount += 1
@@ -202,212 +266,759 @@ def networkChecks(core: bool):
                 time.sleep((coreCF.paceErr * 20))
             time.sleep(coreCF.paceErr)
 
-    retryCount = 0
-    while True:
-        if core is True:
-            netChecks = coreCF.network
+    if core:
+        netChecks = coreCF.network
+    else:
+        netChecks = targetCF.network
+    netKey = tuple(sorted(netChecks.items()))
+    with netLocks.setdefault(netKey, threading.Lock()):
+        if netKey in netResults:
+            log.info("Same Addresses Already Probed")
+            return netResults[netKey]
+        latencies = probe.cached(cachePath, repr(netKey), ttl)
+        if latencies is not None:
+            log.info("Same Addresses Reached Recently, Skipping Probes")
         else:
-            netChecks = targetCF.network
-        bad = 0
-        for itemName, itemVal in netChecks.items():
-            log.info(f"Pinging {itemName}")
-            st = time.perf_counter()
-            if ping(itemVal):
-                en = time.perf_counter()
-                log.info(
-                    f"{itemName} Ping Successful {round((st - en) * 1000)}ms")
-                time.sleep((coreCF.paceNorm / 1000))
-            else:
-                log.error(f"Unsuccessful Pinging {itemName}")
-                bad += 1
+            latencies = probeNetwork(netChecks)
+            if None not in latencies.values():
+                probe.remember(cachePath, repr(netKey), latencies)
+        netResults[netKey] = latencies
+    return netResults[netKey]
 
-        if bad > 0:
-            retryCount += 1
-            if retryCount == retryMax:
-                log.fatal("Reached Maximum Retries!")
-                return False
-            time.sleep(coreCF.paceErr)
+
+def networkReachable(core: bool, targetCF=None) -> bool:
+    """Whether every core/target address could be reached"""
+    return None not in networkChecks(core=core, targetCF=targetCF).values()
+
+
+def probeNetwork(netChecks: dict[str, str]) -> dict[str, float | None]:
+    """Probes all addresses at once, logging the result of each"""
+    import probe
+
+    log.info(f"Probing {', '.join(netChecks)}")
+    latencies = probe.probe_all(
+        hosts=netChecks,
+        port=coreCF.probePort,
+        timeout=coreCF.probeTimeout,
+        retry=coreCF.retry,
+        paceErr=coreCF.paceErr,
+    )
+    for itemName, latency in latencies.items():
+        if latency is None:
+            log.error(f"Unsuccessful Probing {itemName}")
         else:
-            break
+            log.info(f"{itemName} Probe Successful {round(latency)}ms")
+    if None in latencies.values():
+        log.fatal("Reached Maximum Retries!")
+    return latencies
+
+
+pipLock = threading.Lock()
+
+
+def installRequirements(name: str, reqPath: str) -> bool:
+    """Runs pip for whatever in reqPath isn't already installed"""
+    import reqcache
+
+    cachePath = pajoin(curDir, "reqcache.json")
+    if not util.check_exist(itemPath=reqPath, isFile=True):
+        return False
+    with pipLock:
+        if reqcache.is_cached(cachePath=cachePath, itemPath=reqPath):
+            log.info(f"{name} Modules Unchanged Since Last Install")
+            return True
+        missing = reqcache.unsatisfied(itemPath=reqPath)
+        if missing is None:
+            pipArgs = ["-r", reqPath]
+        else:
+            pipArgs = missing
+        if pipArgs:
+            pipComm = [sys.executable, "-m", "pip", "install", *pipArgs]
+            if not run_comm(name=f"Python pip {name}", comm=pipComm):
+                return False
+        reqcache.store(cachePath=cachePath, itemPath=reqPath)
+    log.info(f"{name} Modules Installed")
     return True
 
 
-log.info("Checking Network...")
-if networkChecks(core=True):
-    log.info("Core Network Checks Completed")
-else:
-    log.error("Core Network Checks Failed!")
+def attachVenv(name: str, releasePath: str, reqPath: str) -> bool:
+    """Gives a release its own venv of reqPath, built from the wheelhouse"""
+    import venvs
+
+    if not venvs.attach(
+        releasePath=releasePath,
+        reqPath=reqPath,
+        venvDir=pajoin(curDir, coreCF.venvDirectory),
+        wheelhouse=pajoin(curDir, coreCF.wheelDirectory),
+        run=partial(run_comm, nullOut=True),
+    ):
+        return False
+    log.info(f"{name} venv Ready")
+    return True
 
 
 def moduleChecks():
-    """Ensures any required python modules are installed."""
-    coreReqs = [
-        "python",
-        "-m",
-        "pip",
-        "install",
-        "-r",
-        f"{pajoin(curDir, coreCF.requiredModules)}",
-    ]
-    if not run_comm(name="Python pip Core", comm=coreReqs):
-        return False
-    log.info("Core Modules Installed")
-    log.debug(f"tarReqMod: {targetCF.requiredModules}")
-    if targetCF.requiredModules is not False:
-        targetReqs = [
-            "python",
-            "-m",
-            "pip",
-            "install",
-            "-r",
-            f"{pajoin(curDir, targetCF.requiredModules)}",
-        ]
-        if not run_comm(name="Python pip Target", comm=targetReqs):
+    """Ensures any required python modules are installed. Only runs pip for what's missing."""
+    reqFiles = {"Core": pajoin(curDir, coreCF.requiredModules)}
+    for targetCF in targetsCF:
+        log.debug(f"tarReqMod: {targetCF.requiredModules}")
+        if targetCF.requiredModules is not False:
+            tarDir, _, _ = targetDirs(targetCF)
+            reqPath = pajoin(tarDir, targetCF.requiredModules)
+            if coreCF.venvDirectory is not None:
+                if not attachVenv(targetCF.targetDirectory, tarDir, reqPath):
+                    return False
+            elif os.path.realpath(reqPath) not in map(
+                os.path.realpath, reqFiles.values()
+            ):
+                reqFiles[targetCF.targetDirectory] = reqPath
+    for name, reqPath in reqFiles.items():
+        if not installRequirements(name=name, reqPath=reqPath):
             return False
-        log.info("Target Modules Installed")
-    else:
-        return True
     return True
 
 
-log.info("Checking Module Requirements...")
-if coreCF.checkRequiredPackages:
-    if moduleChecks():
-        log.info("Module Check Successful")
-    else:
-        log.fatal("Module Checks Failed!")
-        exit()
+def compareVersion(mirPath: str, commit: str, tarDir: str) -> bool:
+    """Whether the changelog.json at commit has a newer version than the deployed one.
+    Read from the mirror's objects, so nothing is written unless there is an update"""
+    import mirror
+    import versions
 
+    log.info("Compare Version Numbers")
+    tarVer = versions.deployed_version(folder=tarDir)
+    gitVer = versions.upstream_version(
+        mirror.read_file(mirrorPath=mirPath, commit=commit, path="changelog.json")
+    )
+    log.info(f"{tarVer=}| {gitVer=}")
+    return versions.is_newer(new=gitVer, old=tarVer)
+
+
+def archiveRelease(targetCF, releasePath: str | None):
+    """Archives a superseded release, then applies retention to releases and archive"""
+    import archive
+    import release
+    import venvs
+
+    log.debug(f"run| {releasePath=}")
+    tarDir, relDir, arcDir = targetDirs(targetCF)
+    if releasePath is not None:
+        curDT = datetime.today().strftime("%Y-%m-%d_%H:%M")
+        repoName = targetCF.repository.rstrip("/").split("/")[-1]
+        targetBak = f"{repoName} {coreCF.folderSeperator} {curDT}"
+        if archive.store(archiveDir=arcDir, source=releasePath, name=targetBak) is None:
+            log.error(f"Unable To Archive! {releasePath=}")
+            return
+    release.prune(activePath=tarDir, releasesDir=relDir, keep=targetCF.releaseKeep)
+    if coreCF.venvDirectory is not None:
+        inUse = []
+        for otherCF in targetsCF:
+            otherDir, otherRel, _ = targetDirs(otherCF)
+            inUse += [otherDir, *release.listing(otherRel)]
+        removed = venvs.prune(
+            venvDir=pajoin(curDir, coreCF.venvDirectory), releases=inUse
+        )
+        log.info(f"Unused venvs Removed| {removed=}")
+    pruned = archive.prune(
+        archiveDir=arcDir, keep=targetCF.archiveKeep, maxAge=targetCF.archiveMaxAge
+    )
+    collected = archive.collect_garbage(archiveDir=arcDir)
+    log.info(f"Archive Maintained| {pruned=}| {collected=}")
 
-def getVersionJSON(target: bool, filename: str = "changelog.json") -> str | bool:
-    """Gets last key from the changelog.json in either gitDown or target directory"""
-    if target:
-        fold = "gitDown"
-    else:
-        fold = targetCF.targetDirectory
-    file = pajoin(curDir, fold, filename)
-    if not util.check_exist(itemPath=pajoin(fold, filename), isFile=True):
+
+def copyRequired(
+    item: str, isFile: bool, tarDir: str, releasePath: str, hardlink: bool
+):
+    """Copies required files/folders from the active release into releasePath"""
+    log.debug(f"copyRequired| {item=}")
+    src = pajoin(tarDir, item)
+    dst = pajoin(releasePath, item)
+    if not util.check_exist(itemPath=src, isFile=isFile):
+        log.error(f"Unable To Copy Required Item {isFile=}| {item=}")
         return False
-    try:
-        with open(file, "r") as text:
-            chanJSON = json.load(text)
-            return str(list(chanJSON.keys())[-1])
-    except Exception:
-        log.exception("Changelog JSON File Open")
+    stats = util.sync_thing(
+        source=src, destination=dst, isFile=isFile, hardlink=hardlink
+    )
+    if stats is None:
+        log.error(f"Unable To Copy Required Item {isFile=}| {item=}")
         return False
+    metrics.add("copy_bytes_total", stats["bytes"], kind="required")
+    for outcome in ("skipped", "linked", "copied"):
+        metrics.add("copy_files_total", stats[outcome], outcome=outcome)
+    log.debug(f"Required Item Copied {stats=}")
+    return True
 
 
-def compareVersion():
-    log.info("Compare Version Numbers")
-    tarVer = getVersionJSON(target=True)
-    gitVer = getVersionJSON(target=False)
-    if tarVer or gitVer is False:
-        return False
-    else:
-        return version.parse(tarVer) < version.parse(gitVer)
+mirrorLocks = {}
+headLocks = {}
+# {target directory: remote HEAD} of commits whose version wasn't newer than the deployed one,
+# or that were rolled back from
+versionSkipped = {}
 
 
-curDT = datetime.today().strftime("%Y-%m-%d_%H:%M")
-targetBak = f"{targetCF.repository.split('/')[-1]} {coreCF.folderSeperator} {curDT}"
-arcDir = pajoin(curDir, targetCF.archiveDirectory, targetBak)
+def readHead(gitURL: str, shared: dict) -> str | None:
+    """Returns the remote HEAD of gitURL, reading it only once per shared"""
+    import mirror
 
+    with headLocks.setdefault(gitURL, threading.Lock()):
+        if ("head", gitURL) not in shared:
+            shared[("head", gitURL)] = mirror.remote_head(gitURL)
+        return shared[("head", gitURL)]
 
-def copyRequired(item: str, isFile: bool):
-    """Copies required files/folders from target"""
-    log.debug(f"copyRequired| {item=}")
-    src = pajoin(arcDir, item)
-    dst = pajoin(tarDir, item)
-    if util.copymove_thing(
-        source=src, destination=dst, isFile=isFile, copy=True, overwrite=True
-    ):
-        log.debug("Required Item Copied")
-        return True
-    else:
-        log.error(f"Unable To Copy Required Item {isFile=}| {item=}")
-        return False
 
+def checkTarget(targetCF, shared: dict) -> bool | None:
+    """Whether remote HEAD may be an update, by reading only the ref. None if unreadable"""
+    import mirror
+    import release
 
-def gitClone() -> bool:
-    """Downloads default branch of repo. Moves what's in active to archive."""
-    log.debug("run")
-    from git import Repo
+    tarDir, relDir, _ = targetDirs(targetCF)
+    remoteHead = readHead(mirror.remote_url(targetCF.repository), shared)
+    if remoteHead is None:
+        return None
+    return remoteHead not in (
+        release.deployed_commit(tarDir),
+        versionSkipped.get(tarDir),
+    ) and not release.failed(releasesDir=relDir, commit=remoteHead)
 
-    gitURL = f"http://github.com/{targetCF.repository}.git"
-    gitFold = pajoin(curDir, "gitDown")
-    if os.path.exists(gitFold):
-        util.remove_thing(itemPath=gitFold, isFile=False)
-    os.mkdir(gitFold)
-    try:
-        Repo.clone_from(gitURL, gitFold)
-    except Exception:
-        log.exception("Github Clone")
-    log.info("Repository Clone Successful")
 
+def gitClone(targetCF, shared: dict) -> str | None:
+    """Updates local mirror of repo and builds a release of remote HEAD. Returns its path.
+    Remote HEAD and mirror fetches are recorded in shared, so targets of the same repo reuse them"""
+    import mirror
+    import release
+
+    log.debug("run")
+    tarDir, relDir, _ = targetDirs(targetCF)
+    gitURL = mirror.remote_url(targetCF.repository)
+    mirPath = pajoin(
+        curDir, coreCF.mirrorDirectory, mirror.mirror_name(targetCF.repository)
+    )
+    if not release.adopt_legacy(activePath=tarDir, releasesDir=relDir):
+        return None
+    with mirrorLocks.setdefault(mirPath, threading.Lock()):
+        remoteHead = readHead(gitURL, shared)
+        if remoteHead is None:
+            log.error(f"Unable To Read Remote HEAD {gitURL=}")
+            return None
+        if remoteHead == release.deployed_commit(tarDir):
+            log.info(f"Deployed Commit Is Remote HEAD {remoteHead[:12]}")
+            return None
+        if remoteHead == versionSkipped.get(tarDir):
+            log.info(f"Remote HEAD {remoteHead[:12]} Already Found Not Newer")
+            return None
+        if release.failed(releasesDir=relDir, commit=remoteHead):
+            log.info(f"Remote HEAD {remoteHead[:12]} Failed Before, Skipping")
+            return None
+        if ("fetched", mirPath) not in shared:
+            if not mirror.update_mirror(
+                url=gitURL, mirrorPath=mirPath, depth=targetCF.gitDepth
+            ):
+                return None
+            shared[("fetched", mirPath)] = True
     if targetCF.checkVersion:
-        if not compareVersion():
+        if not compareVersion(mirPath=mirPath, commit=remoteHead, tarDir=tarDir):
             log.info("Git Version <= Target Version")
-            return False
-    log.info("Moving active to archive")
-    if util.copymove_thing(source=tarDir, destination=arcDir, isFile=False, copy=False):
-        log.info(f"Moved! {tarDir=}\n{arcDir=}")
-    else:
-        log.error(f"Unable To Move! {tarDir=}\n{arcDir=}")
-        return False
-    log.info("Moving gitclone to active")
-    if util.copymove_thing(
-        source=gitFold, destination=tarDir, isFile=False, copy=False
-    ):
-        log.info(f"Moved! {gitFold=}\n{tarDir=}")
-    else:
-        log.error(f"Unable To Move! {gitFold=}\n{tarDir=}")
-        return False
-    return True
+            versionSkipped[tarDir] = remoteHead
+            return None
+    releasePath = release.build(
+        mirrorPath=mirPath,
+        commit=remoteHead,
+        releasesDir=relDir,
+        previous=release.current(tarDir),
+    )
+    return releasePath
 
 
-if coreCF.gitHub:
-    log.info("Downloading From Github...")
-    if gitClone():
-        log.info("Complete")
-    else:
-        log.error("Github Clone Failed!")
+def prepareTarget(targetCF, shared: dict) -> str | None:
+    """Builds the newest release of a target with its required files/folders and modules.
+    Doesn't touch the active release. Returns the new release path, None if no update"""
+    tarDir, _, _ = targetDirs(targetCF)
+    newRelease = gitClone(targetCF, shared)
+    if newRelease is None:
+        return None
     log.info("Copying Required Files...")
     for item in targetCF.requiredFiles:
-        copyRequired(item=item, isFile=True)
+        copyRequired(
+            item=item,
+            isFile=True,
+            tarDir=tarDir,
+            releasePath=newRelease,
+            hardlink=targetCF.hardlinkRequired,
+        )
     log.info("Copy Successful")
     log.info("Copying Required Folders...")
     for item in targetCF.requiredFolders:
-        copyRequired(item=item, isFile=False)
+        copyRequired(
+            item=item,
+            isFile=False,
+            tarDir=tarDir,
+            releasePath=newRelease,
+            hardlink=targetCF.hardlinkRequired,
+        )
     log.info("Copy Successful")
-else:
-    log.info("Github Not Enabled... Skipping")
+    if coreCF.checkRequiredPackages and targetCF.requiredModules is not False:
+        reqPath = pajoin(newRelease, targetCF.requiredModules)
+        if coreCF.venvDirectory is not None:
+            installed = attachVenv(targetCF.targetDirectory, newRelease, reqPath)
+        else:
+            installed = installRequirements(
+                name=targetCF.targetDirectory, reqPath=reqPath
+            )
+        if not installed:
+            log.error("Unable To Install Modules Of New Release!")
+            return None
+    return newRelease
 
-if targetCF.network is not None:
-    log.info("Performing Target Network Checks")
-    if networkChecks(core=False):
-        log.info("Target Network Checks Successful")
-    else:
-        log.error("Target Networks Unreachable!")
-
-
-def triggerTarget():
-    """Run the target script"""
-    log.info("Trigging Target Script")
-    while True:
-        botCOMM = ["python", targetCF.scriptName]
-        try:
-            run_comm(name="TriggerTarget", comm=botCOMM, wd=tarDir)
-        except Exception as xcp:
-            log.exception("TryTriggerTarget")
-            time.sleep(coreCF.paceErr)
-            if str(targetCF.restartCode) not in xcp.returncode:
-                break
-    return int(xcp.returncode)
 
+def activateTarget(targetCF, releasePath: str) -> bool:
+    """Switches a target to releasePath, then archives the release it replaced"""
+    import release
+
+    tarDir, _, _ = targetDirs(targetCF)
+    oldRelease = release.current(tarDir)
+    if not release.activate(activePath=tarDir, releasePath=releasePath):
+        log.error("Unable To Activate Release!")
+        return False
+    log.info("Complete")
+    threading.Thread(
+        target=archiveRelease, args=(targetCF, oldRelease), name="archive"
+    ).start()
+    return True
+
+
+def rollbackTarget(targetCF) -> bool:
+    """Switches a target back to its previous release. The commit rolled back from is
+    marked so in its manifest, so isn't deployed again, even after a restart"""
+    import release
+
+    tarDir, relDir, _ = targetDirs(targetCF)
+    badCommit = release.deployed_commit(tarDir)
+    previous = release.rollback(activePath=tarDir, releasesDir=relDir)
+    if previous is None:
+        return False
+    log.warning(f"Rolled Back {targetCF.targetDirectory}| {badCommit=}| {previous=}")
+    return True
+
+
+def rejectTarget(targetCF, releasePath: str):
+    """Marks a release that failed to start beside the old one, so it isn't started
+    again until remote HEAD moves on"""
+    import release
+
+    release.mark_failed(releasePath, reason="notReady")
+    log.warning(f"Release Of {targetCF.targetDirectory} Rejected| {releasePath=}")
 
-log.info("Ready To Trigger Script...")
-if coreCF.launchTarget:
-    returncode = triggerTarget()
-    log.critical(f"Target Script Exited! {returncode=}")
 
+def updateTarget(targetCF, shared: dict) -> bool:
+    """Deploys the newest release of a target before it's launched"""
+    log.info(f"Updating {targetCF.targetDirectory} From Github...")
+    newRelease = prepareTarget(targetCF, shared)
+    if newRelease is None:
+        log.info("No Update Deployed")
+        threading.Thread(
+            target=archiveRelease, args=(targetCF, None), name="archive"
+        ).start()
+        return True
+    return activateTarget(targetCF, newRelease)
+
+
+def startupPhases(update: bool = True) -> "list[phases.Phase]":
+    """Startup pipeline, each phase runs as soon as those it's after are done.
+    Targets are only updated with update and Github enabled"""
+    import phases
+
+    pipeline = [
+        phases.Phase(name="basic", func=basicChecks),
+        phases.Phase(
+            name="network",
+            func=partial(networkReachable, core=True),
+            required=False,
+        ),
+    ]
+    if coreCF.checkRequiredPackages:
+        pipeline.append(
+            phases.Phase(name="modules", func=moduleChecks, after=("basic",))
+        )
+    shared = {}
+    for targetCF in targetsCF:
+        if update and coreCF.gitHub:
+            pipeline.append(
+                phases.Phase(
+                    name=f"update {targetCF.targetDirectory}",
+                    func=partial(updateTarget, targetCF, shared),
+                    after=("basic", "network"),
+                    required=False,
+                )
+            )
+        if targetCF.network is not None:
+            pipeline.append(
+                phases.Phase(
+                    name=f"network {targetCF.targetDirectory}",
+                    func=partial(networkReachable, core=False, targetCF=targetCF),
+                    after=("network",),
+                    required=False,
+                )
+            )
+    return pipeline
+
+
+def targetOutput(targetCF) -> "capture.Capture | None":
+    """Where a target's stdout/stderr goes, None to let it inherit ours"""
+    import capture
+
+    if targetCF.outputDirectory is None:
+        return None
+    folder = pajoin(curDir, targetCF.outputDirectory)
+    name = targetCF.targetDirectory.replace(os.sep, "_")
+    logger = capture.target_logger(
+        name=name,
+        folder=folder,
+        maxBytes=coreCF.logMaxBytes,
+        backupCount=coreCF.logBackups,
+        maxAge=coreCF.logMaxAge * 86400,
+    )
+    return capture.Capture(
+        name=name,
+        logger=logger,
+        folder=folder,
+        bufferSize=targetCF.outputBuffer * 1024,
+    )
+
+
+def applyConfig(newCore, newTargets: list):
+    """Applies a reloaded config. Target changes other than config.targetLive wait until
+    the target next starts, adding/removing targets waits until this script next starts"""
+    changed = config.changed(coreCF, newCore)
+    later = [name for name in changed if name in config.coreRestart]
+    config.copy(coreCF, newCore, [name for name in changed if name not in later])
+    if later:
+        log.warning(f"Core Config Applies Once TriggerScript Restarts| {later=}")
+    log.setLevel(coreCF.logLevel.upper())
+    handleFile.limit(
+        maxBytes=coreCF.logMaxBytes,
+        backupCount=coreCF.logBackups,
+        maxAge=coreCF.logMaxAge * 86400,
+    )
+    targetSuper.paceErr = coreCF.paceErr
+    targetSuper.configure_poll(coreCF.pollInterval, coreCF.pollBackoffMax)
+    if targetSuper.listener is not None:
+        targetSuper.listener.debounce = coreCF.webhookDebounce
+    byName = {targetCF.targetDirectory: targetCF for targetCF in newTargets}
+    if set(byName) != {targetCF.targetDirectory for targetCF in targetsCF}:
+        log.warning("Targets Added/Removed, Applies Once TriggerScript Restarts")
+    for targetCF in targetsCF:
+        new = byName.get(targetCF.targetDirectory)
+        if new is None:
+            continue
+        changed = config.changed(targetCF, new)
+        config.copy(
+            targetCF, new, [name for name in changed if name in config.targetLive]
+        )
+        if any(name not in config.targetLive for name in changed):
+            targetSuper.pending[targetCF.targetDirectory] = new
+            log.info(
+                f"Config Of {targetCF.targetDirectory} Applies When It Next Starts"
+            )
+        elif targetCF.targetDirectory in targetSuper.pending:
+            del targetSuper.pending[targetCF.targetDirectory]
+    log.info("Config Reloaded")
+
+
+def exportMetrics():
+    """Writes the run's metrics out, if enabled"""
+    if coreCF.metricsDirectory:
+        metrics.export(
+            folder=pajoin(curDir, coreCF.metricsDirectory),
+            withTrace=coreCF.metricsTrace,
+        )
+
+
+def startupKey() -> str:
+    """Returns the key of what the startup checks depend on: config, interpreter,
+    mtimes of the files/folders checked and the deployed commits"""
+    import release
+    import startstate
+
+    paths = [pajoin(curDir, coreCF.requiredModules)]
+    commits = []
+    for targetCF in targetsCF:
+        tarDir, _, arcDir = targetDirs(targetCF)
+        paths += [arcDir, pajoin(tarDir, targetCF.scriptName)]
+        if targetCF.requiredModules:
+            paths.append(pajoin(tarDir, targetCF.requiredModules))
+        for item in targetCF.requiredFiles + targetCF.requiredFolders:
+            paths.append(pajoin(tarDir, item))
+        commits.append(release.deployed_commit(tarDir))
+    return startstate.state_key(
+        coreCF, targetsCF, paths=sorted(set(paths)), commits=commits
+    )
+
+
+def fastStart() -> bool:
+    """Whether nothing the startup checks depend on has changed since they last passed"""
+    import startstate
+
+    statePath = pajoin(curDir, "startstate.json")
+    return startstate.is_fresh(statePath, startupKey(), coreCF.fastStartMaxAge)
+
+
+def startup(update: bool = True) -> bool:
+    """Runs the startup checks, updating targets first with update.
+    Their success is remembered for fastStart"""
+    import phases
+    import startstate
+
+    statePath = pajoin(curDir, "startstate.json")
+    if not coreCF.gitHub:
+        log.info("Github Not Enabled... Skipping")
+    pipeline = startupPhases(update=update)
+    startupOK = phases.succeeded(pipeline, phases.run_phases(pipeline))
+    metrics.gauge("startup_seconds", time.perf_counter() - metrics.startPerf)
+    exportMetrics()
+    if not startupOK:
+        log.fatal("Startup Failed!")
+        startstate.clear(statePath)
+        return False
+    startstate.store(statePath, startupKey())
+    return True
 
-# MIT APasz
+
+def launch(updateOnStart: bool = False) -> dict[str, int | None]:
+    """Runs every target until they've all stopped. Returns {target directory: last exit code}"""
+    global targetSuper
+    import supervisor
+    import webhook
+
+    log.info("Ready To Trigger Script...")
+    listener = None
+    if coreCF.webhookAddress is not None:
+        if coreCF.webhookSecret:
+            listener = webhook.Listener(
+                address=coreCF.webhookAddress,
+                secret=coreCF.webhookSecret,
+                targets=targetsCF,
+                debounce=coreCF.webhookDebounce,
+            )
+        else:
+            log.error("Webhook Disabled, webhookSecret Not Set")
+    targetSuper = supervisor.Supervisor(
+        targets=targetsCF,
+        baseDir=curDir,
+        paceErr=coreCF.paceErr,
+        prepare=prepareTarget if coreCF.gitHub else None,
+        activate=activateTarget,
+        check=checkTarget,
+        pollInterval=coreCF.pollInterval,
+        pollBackoffMax=coreCF.pollBackoffMax,
+        listener=listener,
+        watcher=None if configPath is None else config.Watcher(configPath, applyConfig),
+        report=exportMetrics,
+        output=targetOutput,
+        updateOnStart=updateOnStart,
+        rollback=rollbackTarget if coreCF.gitHub else None,
+        reject=rejectTarget,
+    )
+    returncodes = targetSuper.start()
+    for name, returncode in returncodes.items():
+        log.critical(f"Target Script Exited! {name=}| {returncode=}")
+    exportMetrics()
+    return returncodes
+
+
+def status() -> list[dict]:
+    """Returns what's deployed for each target, read from disk only"""
+    import release
+    import venvs
+    import versions
+
+    found = []
+    for targetCF in targetsCF:
+        tarDir, relDir, _ = targetDirs(targetCF)
+        active = release.current(tarDir)
+        found.append(
+            {
+                "target": targetCF.targetDirectory,
+                "release": None if active is None else os.path.basename(active),
+                "commit": release.deployed_commit(tarDir),
+                "version": versions.deployed_version(folder=tarDir),
+                "releases": len(release.listing(relDir)),
+                "interpreter": venvs.interpreter(tarDir),
+            }
+        )
+    return found
+
+
+def driftTarget(targetCF, fix: bool = False) -> dict[str, list[str]] | None:
+    """Returns how the active release differs from its commit, ignoring required
+    files/folders. With fix, brings it back in line first"""
+    import drift
+    import mirror
+    import release
+
+    tarDir, _, _ = targetDirs(targetCF)
+    releasePath = release.current(tarDir)
+    if releasePath is None:
+        log.warning(f"{targetCF.targetDirectory} Isn't A Release, Can't Check Drift")
+        return None
+    ignore = targetCF.requiredFiles + targetCF.requiredFolders
+    found = drift.scan(releasePath, ignore=ignore)
+    if not fix or found is None or not any(found.values()):
+        return found
+    mirPath = pajoin(
+        curDir, coreCF.mirrorDirectory, mirror.mirror_name(targetCF.repository)
+    )
+    if drift.sync(releasePath, mirrorPath=mirPath, drift=found) is None:
+        return None
+    return drift.scan(releasePath, ignore=ignore)
+
+
+def archived() -> list[dict]:
+    """Returns every archived release of each target, oldest first"""
+    import archive
+
+    found = []
+    for targetCF in targetsCF:
+        _, _, arcDir = targetDirs(targetCF)
+        for manifest in archive.listing(arcDir):
+            found.append(
+                {
+                    "target": targetCF.targetDirectory,
+                    "name": manifest["name"],
+                    "created": datetime.fromtimestamp(manifest["created"]).isoformat(
+                        sep=" ", timespec="seconds"
+                    ),
+                    "files": len(manifest["files"]),
+                    "bytes": sum(item["size"] for item in manifest["files"].values()),
+                }
+            )
+    return found
+
+
+def restoreArchived(targetCF, name: str, destination: str) -> bool:
+    """Recreates the archived release name of a target at destination, which mustn't
+    already have anything in it. The active release isn't touched"""
+    import archive
+
+    _, _, arcDir = targetDirs(targetCF)
+    manifest = next(
+        (item for item in archive.listing(arcDir) if item["name"] == name), None
+    )
+    if manifest is None:
+        log.error(f"No Archived Release Named {name!r} For {targetCF.targetDirectory}")
+        return False
+    if os.path.isdir(destination) and os.listdir(destination):
+        log.error(f"Destination Isn't Empty| {destination=}")
+        return False
+    return archive.restore(
+        archiveDir=arcDir, manifest=manifest, destination=destination
+    )
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Command line entry. With no command, checks, updates then runs the targets"""
+    parser = argparse.ArgumentParser(
+        prog=scriptName, description="Keeps target scripts updated and running"
+    )
+    parser.add_argument("--config", help="config file, default is the one found here")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("check", help="check files, modules and network only")
+    commands.add_parser("update", help="check, then update targets without running")
+    runParser = commands.add_parser("run", help="check, then run targets")
+    runParser.add_argument(
+        "--update", action="store_true", help="update targets before running"
+    )
+    statusParser = commands.add_parser("status", help="show what's deployed")
+    statusParser.add_argument("--json", action="store_true", help="output as JSON")
+    driftParser = commands.add_parser(
+        "drift", help="show how each active release differs from its commit"
+    )
+    driftParser.add_argument(
+        "--sync", action="store_true", help="restore what differs, except required"
+    )
+    archiveParser = commands.add_parser("archive", help="list or restore archives")
+    archiveCommands = archiveParser.add_subparsers(dest="archiveCommand", required=True)
+    archiveList = archiveCommands.add_parser("list", help="show archived releases")
+    archiveList.add_argument("--json", action="store_true", help="output as JSON")
+    archiveRestore = archiveCommands.add_parser(
+        "restore", help="recreate an archived release in an empty folder"
+    )
+    archiveRestore.add_argument("name", help="name shown by archive list")
+    archiveRestore.add_argument("destination", help="folder to restore into")
+    archiveRestore.add_argument(
+        "--target", help="target directory, needed if there's more than one target"
+    )
+    args = parser.parse_args(argv)
+    command = args.command or "all"
+
+    if command == "status":
+        if not setup(itemPath=args.config, consoleLevel=logging.WARNING):
+            return 1
+        found = status()
+        if args.json:
+            print(json.dumps(found, indent=4))
+            return 0
+        for item in found:
+            print(" | ".join(f"{key}: {val}" for key, val in item.items()))
+        return 0
+
+    if command == "drift":
+        if not setup(itemPath=args.config, consoleLevel=logging.WARNING):
+            return 1
+        clean = True
+        for targetCF in targetsCF:
+            found = driftTarget(targetCF, fix=args.sync)
+            if found is None:
+                clean = False
+                continue
+            print(json.dumps({targetCF.targetDirectory: found}, indent=4))
+            clean = clean and not any(found.values())
+        return 0 if clean else 1
+
+    if command == "archive":
+        if not setup(itemPath=args.config, consoleLevel=logging.WARNING):
+            return 1
+        if args.archiveCommand == "list":
+            found = archived()
+            if args.json:
+                print(json.dumps(found, indent=4))
+                return 0
+            for item in found:
+                print(" | ".join(f"{key}: {val}" for key, val in item.items()))
+            return 0
+        matched = [
+            targetCF
+            for targetCF in targetsCF
+            if args.target in (None, targetCF.targetDirectory)
+        ]
+        if len(matched) != 1:
+            names = [targetCF.targetDirectory for targetCF in targetsCF]
+            log.error(f"Give --target As One Of {names}")
+            return 1
+        restored = restoreArchived(
+            matched[0], name=args.name, destination=os.path.abspath(args.destination)
+        )
+        return 0 if restored else 1
+
+    print(f"*** Starting ***\nPID: {os.getpid()}")
+    if not setup(itemPath=args.config):
+        return 1
+    banner()
+    update = command in ("all", "update") or getattr(args, "update", False)
+    launching = command in ("all", "run") and coreCF.launchTarget
+    if launching and fastStart():
+        log.info("Nothing Changed Since Last Startup, Launching Before Checks")
+        metrics.add("fast_starts_total")
+        metrics.gauge("startup_seconds", time.perf_counter() - metrics.startPerf)
+        threading.Thread(
+            target=startup, kwargs={"update": False}, name="checks"
+        ).start()
+        launch(updateOnStart=update)
+        return 0
+    if not startup(update=update):
+        return 1
+    if launching:
+        launch()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
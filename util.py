@@ -1,31 +1,42 @@
 import os
+import hashlib
 import logging
 import sys
 import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 log = logging.getLogger("TSlog")
 
+# ioctl asking the filesystem to share the source's blocks with the destination (btrfs, xfs)
+FICLONE = 0x40049409
+chunkSize = 1024 * 1024
+
 
 def check_exist(itemPath: str, isFile: bool) -> bool:
     """Checks if a file/folder exists"""
-    log.debug(f"{isFile=} | {itemPath=}")
+    log.debug("isFile=%r | itemPath=%r", isFile, itemPath)
     if os.path.exists(itemPath):
-        log.info(f"{isFile=} Exists: {itemPath=}")
+        log.info("isFile=%r Exists: itemPath=%r", isFile, itemPath)
         return True
     else:
-        log.warning(f"{isFile=} Missing: {itemPath=}")
+        log.warning("isFile=%r Missing: itemPath=%r", isFile, itemPath)
         return False
 
 
 def remove_thing(itemPath: str, isFile: bool) -> bool:
     """Removes a file/folder"""
-    log.debug(f"run| {isFile=}| {itemPath=}")
+    log.debug("run| isFile=%r| itemPath=%r", isFile, itemPath)
     if not check_exist(itemPath=itemPath, isFile=isFile):
         return False
     if isFile:
         try:
             os.remove(itemPath)
-            log.debug(f"DeleteFile {itemPath=}")
+            log.debug("DeleteFile itemPath=%r", itemPath)
             return True
         except Exception:
             log.exception("DeleteFile")
@@ -33,15 +44,15 @@ def remove_thing(itemPath: str, isFile: bool) -> bool:
     else:
         try:
             os.rmdir(itemPath)
-            log.debug(f"DeleteEmptyFolder {itemPath=}")
+            log.debug("DeleteEmptyFolder itemPath=%r", itemPath)
             return True
         except OSError:
             try:
                 shutil.rmtree(itemPath)
-                log.debug(f"DeleteNonEmptyFolder {itemPath=}")
+                log.debug("DeleteNonEmptyFolder itemPath=%r", itemPath)
                 return True
             except Exception:
-                log.exception(f"DeleteNonEmptyFodler")
+                log.exception("DeleteNonEmptyFodler")
                 return False
         except Exception:
             log.exception("DeleteEmptyFolder")
@@ -50,12 +61,12 @@ def remove_thing(itemPath: str, isFile: bool) -> bool:
 
 def same_name(item: str, isFile: bool) -> str:
     """Return file/folder name but appeneded with -#"""
-    log.debug(f"run| {isFile=}| {item=}")
+    log.debug("run| isFile=%r| item=%r", isFile, item)
     ext = None
     if isFile:
         item, ext = item.rsplit(".", maxsplit=1)
         ext = "." + ext
-    log.debug(f"{item=}| {ext=}")
+    log.debug("item=%r| ext=%r", item, ext)
     if "-" in item[-4:]:
         item, var = item.split(" -")
         var = str(int(var) + 1)
@@ -64,17 +75,17 @@ def same_name(item: str, isFile: bool) -> str:
         itemEdit = item + " -1"
     if isFile and (ext is not None):
         itemEdit = itemEdit + ext
-    log.debug(f"{itemEdit=}")
+    log.debug("itemEdit=%r", itemEdit)
     return itemEdit
 
 
 def make_thing(itemPath: str, isFile: bool, overwrite: bool = False) -> bool:
     """Makes an empty file/folder"""
-    log.debug(f"run| {isFile=}| {overwrite=}| {itemPath=}")
+    log.debug("run| isFile=%r| overwrite=%r| itemPath=%r", isFile, overwrite, itemPath)
     if os.path.exists(itemPath):
         if overwrite:
             os.remove(itemPath)
-            log.debug(f"{overwrite=}| {itemPath=}")
+            log.debug("overwrite=%r| itemPath=%r", overwrite, itemPath)
         else:
             log.debug("MakeThing")
             path, item = itemPath.rsplit(os.sep, maxsplit=1)
@@ -99,16 +110,162 @@ def make_thing(itemPath: str, isFile: bool, overwrite: bool = False) -> bool:
             return False
 
 
+def file_hash(itemPath: str) -> str:
+    """Returns sha256 of a file's content"""
+    hasher = hashlib.sha256()
+    with open(itemPath, "rb") as file:
+        while chunk := file.read(chunkSize):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def files_match(source: str, destination: str) -> bool:
+    """Whether destination already has source's content. Equal size and mtime is
+    taken as a match, equal size with a different mtime is settled by hash"""
+    try:
+        srcStat = os.stat(source)
+        dstStat = os.stat(destination, follow_symlinks=False)
+    except FileNotFoundError:
+        return False
+    if not os.path.isfile(destination) or srcStat.st_size != dstStat.st_size:
+        return False
+    if srcStat.st_mtime_ns == dstStat.st_mtime_ns:
+        return True
+    if file_hash(source) != file_hash(destination):
+        return False
+    os.utime(destination, ns=(srcStat.st_atime_ns, srcStat.st_mtime_ns))
+    return True
+
+
+def copy_file(source: str, destination: str):
+    """Copies a file with its metadata, as a reflink or in-kernel copy if the filesystem allows"""
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        done = False
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                done = True
+            except OSError:
+                pass
+        if not done and hasattr(os, "copy_file_range"):
+            size = os.fstat(src.fileno()).st_size
+            try:
+                while os.copy_file_range(src.fileno(), dst.fileno(), size):
+                    pass
+                done = True
+            except OSError:
+                pass
+        if not done:
+            # Carries on from wherever copy_file_range got to
+            shutil.copyfileobj(src, dst, chunkSize)
+    shutil.copystat(source, destination)
+
+
+def sync_file(source: str, destination: str, hardlink: bool = False) -> str:
+    """Makes destination a copy of file source. Returns skipped, linked or copied"""
+    if os.path.islink(source):
+        linkTo = os.readlink(source)
+        if os.path.islink(destination) and os.readlink(destination) == linkTo:
+            return "skipped"
+    elif files_match(source=source, destination=destination):
+        return "skipped"
+    if os.path.isdir(destination) and not os.path.islink(destination):
+        remove_thing(itemPath=destination, isFile=False)
+    elif os.path.lexists(destination):
+        # Never write through an existing link into another copy of the file
+        os.remove(destination)
+    if os.path.islink(source):
+        os.symlink(linkTo, destination)
+        return "copied"
+    if hardlink:
+        try:
+            os.link(source, destination)
+            return "linked"
+        except OSError:
+            pass
+    copy_file(source=source, destination=destination)
+    return "copied"
+
+
+def sync_thing(
+    source: str, destination: str, isFile: bool, hardlink: bool = False
+) -> dict | None:
+    """Makes destination a copy of file/folder source, only copying what differs,
+    files in parallel. Returns counts of each outcome and bytes copied, None if failed"""
+    log.debug(
+        "run| isFile=%r| hardlink=%r| source=%r| destination=%r",
+        isFile,
+        hardlink,
+        source,
+        destination,
+    )
+    stats = {"skipped": 0, "linked": 0, "copied": 0, "removed": 0, "bytes": 0}
+    try:
+        if isFile:
+            os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+            pairs = [(source, destination)]
+        else:
+            pairs = []
+            wanted = {os.path.normpath(destination)}
+            for root, dirs, files in os.walk(source):
+                dstRoot = os.path.normpath(
+                    os.path.join(destination, os.path.relpath(root, source))
+                )
+                if os.path.lexists(dstRoot) and not os.path.isdir(dstRoot):
+                    os.remove(dstRoot)
+                os.makedirs(dstRoot, exist_ok=True)
+                for item in dirs:
+                    if os.path.islink(os.path.join(root, item)):
+                        files.append(item)
+                for item in files:
+                    pairs.append(
+                        (os.path.join(root, item), os.path.join(dstRoot, item))
+                    )
+                wanted.update(os.path.join(dstRoot, item) for item in dirs + files)
+            for root, dirs, files in os.walk(destination, topdown=False):
+                for item in dirs + files:
+                    itemPath = os.path.join(root, item)
+                    if itemPath not in wanted:
+                        isDir = os.path.isdir(itemPath) and not os.path.islink(itemPath)
+                        remove_thing(itemPath=itemPath, isFile=not isDir)
+                        stats["removed"] += 1
+
+        def work(pair: tuple[str, str]) -> tuple[str, int]:
+            outcome = sync_file(source=pair[0], destination=pair[1], hardlink=hardlink)
+            if outcome == "copied" and not os.path.islink(pair[0]):
+                return outcome, os.path.getsize(pair[1])
+            return outcome, 0
+
+        with ThreadPoolExecutor() as pool:
+            for outcome, size in pool.map(work, pairs):
+                stats[outcome] += 1
+                stats["bytes"] += size
+    except Exception:
+        log.exception("Sync")
+        return None
+    log.debug("Synced| stats=%r| destination=%r", stats, destination)
+    return stats
+
+
 def copymove_thing(
     source: str, destination: str, isFile: bool, copy: bool, overwrite: bool = False
 ) -> bool:
     """Copyies or moves thing from one place to another"""
-    log.debug(f"run| {isFile=}| {overwrite=}| {source=}| {destination=}")
+    log.debug(
+        "run| isFile=%r| overwrite=%r| source=%r| destination=%r",
+        isFile,
+        overwrite,
+        source,
+        destination,
+    )
     if not check_exist(itemPath=source, isFile=isFile):
         log.error("SRC doesn't exist, nothing to copy")
+        return False
     if os.path.exists(destination):
-        log.warning(f"DST already exists, {overwrite=}")
-        if overwrite:
+        log.warning("DST already exists, overwrite=%r", overwrite)
+        if overwrite and copy:
+            log.debug("Overwrite, only copying what differs")
+        elif overwrite:
             log.debug("Overwrite")
             remove_thing(itemPath=destination, isFile=isFile)
         else:
@@ -117,26 +274,22 @@ def copymove_thing(
             item = same_name(item=item, isFile=isFile)
             destination = os.path.join(path, item)
     if copy:
-        if isFile:
-            try:
-                shutil.copy(src=source, dst=destination)
-                log.info(f"File Copied| {source=}\n{destination=}")
-                return True
-            except Exception:
-                log.exception("Copy File")
-                return False
-        else:
-            try:
-                shutil.copytree(src=source, dst=destination)
-                log.debug(f"Folder Copied| {source=}\n{destination=}")
-                return True
-            except Exception:
-                log.exception(f"Copy Folder")
-                return False
+        if sync_thing(source=source, destination=destination, isFile=isFile) is None:
+            log.error("Unable To Copy isFile=%r", isFile)
+            return False
+        log.info(
+            "isFile=%r Copied| source=%r\ndestination=%r", isFile, source, destination
+        )
+        return True
     else:
         try:
             shutil.move(src=source, dst=destination)
-            log.debug(f"{isFile=} Moved| {source=}\n{destination=}")
+            log.debug(
+                "isFile=%r Moved| source=%r\ndestination=%r",
+                isFile,
+                source,
+                destination,
+            )
             return True
         except Exception:
             log.exception("Move File/Folder")
@@ -0,0 +1,128 @@
+# MIT APasz
+import hashlib
+import logging
+import os
+import sys
+import threading
+import time
+from collections.abc import Callable
+
+import metrics
+import reqcache
+import util
+
+log = logging.getLogger("TSlog")
+
+# Link inside a release to the venv it runs with
+linkName = ".venv"
+# Written once a venv is fully built, one without it is built again
+markerName = ".complete"
+# Venvs and the wheelhouse are only changed by one thread at a time
+lock = threading.Lock()
+
+
+def venv_key(reqPath: str) -> str:
+    """Returns the name of the venv for a requirements file, its content hash plus the interpreter"""
+    return hashlib.sha256(reqcache.cache_key(reqPath).encode()).hexdigest()[:16]
+
+
+def python_path(venvPath: str) -> str:
+    """Returns path of the interpreter of a venv"""
+    if os.name == "nt":
+        return os.path.join(venvPath, "Scripts", "python.exe")
+    return os.path.join(venvPath, "bin", "python")
+
+
+def interpreter(releasePath: str) -> str:
+    """Returns the interpreter a release runs with, its venv's if it has one"""
+    itemPath = python_path(os.path.join(releasePath, linkName))
+    if os.path.exists(itemPath):
+        return itemPath
+    return sys.executable
+
+
+def build(
+    venvPath: str, reqPath: str, wheelhouse: str, run: Callable[[str, list], bool]
+) -> bool:
+    """Creates a venv with reqPath installed from wheelhouse only, never the network.
+    Whatever the wheelhouse lacks is first added to it, which may use the network"""
+    log.info(f"Building venv| {venvPath=}")
+    st = time.perf_counter()
+    if os.path.exists(venvPath):
+        util.remove_thing(itemPath=venvPath, isFile=False)
+    python = python_path(venvPath)
+    install = [python, "-m", "pip", "install", "--no-index"]
+    install += ["--find-links", wheelhouse, "-r", reqPath]
+    if not run("Create venv", [sys.executable, "-m", "venv", venvPath]):
+        return False
+    if not run("Install From Wheelhouse", install):
+        log.info("Wheelhouse Incomplete, Adding Missing Wheels")
+        wheel = [sys.executable, "-m", "pip", "wheel", "--wheel-dir", wheelhouse]
+        wheel += ["--find-links", wheelhouse, "-r", reqPath]
+        if not run("Fill Wheelhouse", wheel) or not run(
+            "Install From Wheelhouse", install
+        ):
+            return False
+    try:
+        with open(os.path.join(venvPath, markerName), "w") as file:
+            file.write(os.path.realpath(reqPath))
+    except OSError:
+        log.exception("venv Marker")
+        return False
+    metrics.record("build", "venv", st, time.perf_counter() - st, venv=venvPath)
+    return True
+
+
+def attach(
+    releasePath: str,
+    reqPath: str,
+    venvDir: str,
+    wheelhouse: str,
+    run: Callable[[str, list], bool],
+) -> bool:
+    """Links releasePath to the venv for its requirements, building it if there isn't one.
+    Releases with the same requirements share a venv"""
+    if not util.check_exist(itemPath=reqPath, isFile=True):
+        return False
+    venvPath = os.path.join(venvDir, venv_key(reqPath))
+    linkPath = os.path.join(releasePath, linkName)
+    with lock:
+        if os.path.exists(os.path.join(venvPath, markerName)):
+            log.info(f"Requirements Unchanged, Reusing venv| {venvPath=}")
+            metrics.add("venv_builds_total", outcome="reused")
+        else:
+            os.makedirs(venvDir, exist_ok=True)
+            os.makedirs(wheelhouse, exist_ok=True)
+            if not build(venvPath, reqPath, wheelhouse, run):
+                log.error(f"Unable To Build venv| {reqPath=}")
+                metrics.add("venv_builds_total", outcome="failed")
+                return False
+            metrics.add("venv_builds_total", outcome="built")
+        try:
+            if os.path.lexists(linkPath):
+                os.remove(linkPath)
+            os.symlink(venvPath, linkPath, target_is_directory=True)
+        except OSError:
+            log.exception("Link venv")
+            return False
+    return True
+
+
+def prune(venvDir: str, releases: list[str]) -> list[str]:
+    """Removes the venvs none of releases link to. Returns those removed"""
+    if not os.path.isdir(venvDir):
+        return []
+    with lock:
+        used = {
+            os.path.realpath(os.path.join(releasePath, linkName))
+            for releasePath in releases
+        }
+        removed = []
+        for entry in os.scandir(venvDir):
+            if (
+                entry.is_dir(follow_symlinks=False)
+                and os.path.realpath(entry.path) not in used
+            ):
+                if util.remove_thing(itemPath=entry.path, isFile=False):
+                    removed.append(entry.path)
+    return removed
@@ -0,0 +1,71 @@
+# MIT APasz
+import json
+import logging
+import os
+import threading
+
+log = logging.getLogger("TSlog")
+
+lock = threading.Lock()
+# {realpath: (mtime_ns, size, version)} of deployed changelogs
+deployed = {}
+# {blob sha: version} of changelogs read from git, blobs never change
+upstream = {}
+
+
+def parse_changelog(data: bytes) -> str | None:
+    """Returns the last key of a changelog.json, the latest version"""
+    try:
+        return str(list(json.loads(data).keys())[-1])
+    except Exception:
+        log.exception("Changelog JSON Parse")
+        return None
+
+
+def deployed_version(folder: str, filename: str = "changelog.json") -> str | None:
+    """Returns the version in folder's changelog, only reading it again once it changes"""
+    itemPath = os.path.realpath(os.path.join(folder, filename))
+    try:
+        stat = os.stat(itemPath)
+    except FileNotFoundError:
+        log.warning(f"Missing Changelog| {itemPath=}")
+        return None
+    with lock:
+        cached = deployed.get(itemPath)
+    if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+    with open(itemPath, "rb") as file:
+        found = parse_changelog(file.read())
+    with lock:
+        deployed[itemPath] = (stat.st_mtime_ns, stat.st_size, found)
+    return found
+
+
+def upstream_version(blob: tuple[str, bytes] | None) -> str | None:
+    """Returns the version in a changelog blob as read by mirror.read_file"""
+    if blob is None:
+        return None
+    sha, data = blob
+    with lock:
+        if sha in upstream:
+            return upstream[sha]
+    found = parse_changelog(data)
+    with lock:
+        upstream[sha] = found
+    return found
+
+
+def is_newer(new: str | None, old: str | None) -> bool:
+    """Whether version new is after version old. An unknown new version is never newer,
+    a known one is newer than an unknown old one"""
+    if new is None:
+        return False
+    if old is None:
+        return True
+    from packaging import version
+
+    try:
+        return version.parse(new) > version.parse(old)
+    except version.InvalidVersion:
+        log.exception("Version Parse")
+        return False
@@ -0,0 +1,172 @@
+# MIT APasz
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+from http import HTTPStatus
+from typing import Callable
+
+import metrics
+import mirror
+
+log = logging.getLogger("TSlog")
+
+maxBody = 1024 * 1024
+readTimeout = 10
+
+
+def verify(secret: str, body: bytes, signature: str | None) -> bool:
+    """Whether signature (X-Hub-Signature-256) is the HMAC of body under secret"""
+    if not signature or not signature.startswith("sha256="):
+        return False
+    digest = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(digest, signature.removeprefix("sha256="))
+
+
+def repo_key(repository: str) -> str:
+    """Returns repository as "host/user/repo" or a path, so different URL forms compare equal"""
+    key = repository.strip().rstrip("/").removesuffix(".git").casefold()
+    if key.startswith("git@"):
+        key = key.removeprefix("git@").replace(":", "/", 1)
+    return key.split("://", maxsplit=1)[-1]
+
+
+def matching(targets: list, payload: dict) -> list:
+    """Returns the targets whose repository the push payload is for"""
+    repo = payload.get("repository") or {}
+    names = {
+        repo_key(repo[field])
+        for field in ("full_name", "clone_url", "ssh_url", "git_url", "html_url", "url")
+        if isinstance(repo.get(field), str)
+    }
+    found = []
+    for targetCF in targets:
+        keys = {
+            repo_key(targetCF.repository),
+            repo_key(mirror.remote_url(targetCF.repository)),
+        }
+        if names & keys:
+            found.append(targetCF)
+    return found
+
+
+def default_branch(payload: dict) -> bool:
+    """Whether the push was to the repository's default branch, the one deploys follow"""
+    branch = (payload.get("repository") or {}).get("default_branch")
+    if not branch:
+        return True
+    return payload.get("ref") == f"refs/heads/{branch}"
+
+
+class Listener:
+    """Accepts Github style push webhooks, triggering an update of the matching targets
+    once pushes have stopped arriving for debounce seconds"""
+
+    def __init__(self, address: str, secret: str, targets: list, debounce: float):
+        self.host, _, port = address.rpartition(":")
+        self.port = int(port)
+        self.secret = secret
+        self.targets = targets
+        self.debounce = debounce
+        self.trigger = None
+        self.server = None
+        # {target directory: pending call}
+        self.timers = {}
+
+    async def start(self, trigger: Callable[[list], object]):
+        """Starts listening. trigger(targets) is called to update targets"""
+        self.trigger = trigger
+        self.server = await asyncio.start_server(
+            self.handle, host=self.host or None, port=self.port
+        )
+        log.info(f"Webhook Listening| {self.host}:{self.port}")
+
+    async def stop(self):
+        for timer in self.timers.values():
+            timer.cancel()
+        self.timers.clear()
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    def schedule(self, targetCF):
+        """(Re)starts the debounce timer of a target"""
+        name = targetCF.targetDirectory
+        if name in self.timers:
+            self.timers[name].cancel()
+            metrics.add("webhook_debounced_total", target=name)
+        self.timers[name] = asyncio.get_running_loop().call_later(
+            self.debounce, self.fire, targetCF
+        )
+
+    def fire(self, targetCF):
+        self.timers.pop(targetCF.targetDirectory, None)
+        log.info(f"Webhook Triggering Update Of {targetCF.targetDirectory}")
+        self.trigger([targetCF])
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            status, reply = await asyncio.wait_for(
+                self.respond(reader), timeout=readTimeout
+            )
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+            status, reply = HTTPStatus.BAD_REQUEST, {"error": "bad request"}
+        except asyncio.LimitOverrunError:
+            status, reply = HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, {}
+        metrics.add("webhook_requests_total", status=int(status))
+        body = json.dumps(reply).encode()
+        writer.write(
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode() + body
+        )
+        try:
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    async def respond(self, reader: asyncio.StreamReader) -> tuple[HTTPStatus, dict]:
+        """Reads one request, returning the status and JSON body to reply with"""
+        head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1")
+        requestLine, *lines = head.split("\r\n")
+        method = requestLine.split(" ", maxsplit=1)[0]
+        headers = {}
+        for line in lines:
+            if ":" in line:
+                key, val = line.split(":", maxsplit=1)
+                headers[key.strip().casefold()] = val.strip()
+        if method != "POST":
+            return HTTPStatus.METHOD_NOT_ALLOWED, {"error": "POST only"}
+        length = int(headers.get("content-length", 0))
+        if length > maxBody:
+            return HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {"error": "too large"}
+        body = await reader.readexactly(length)
+        if not verify(self.secret, body, headers.get("x-hub-signature-256")):
+            log.warning("Webhook Signature Invalid")
+            return HTTPStatus.UNAUTHORIZED, {"error": "bad signature"}
+        event = headers.get("x-github-event", "push")
+        if event == "ping":
+            return HTTPStatus.OK, {"pong": True}
+        if event != "push":
+            return HTTPStatus.ACCEPTED, {"ignored": event}
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return HTTPStatus.BAD_REQUEST, {"error": "bad json"}
+        if not isinstance(payload, dict) or not isinstance(
+            payload.get("repository") or {}, dict
+        ):
+            return HTTPStatus.BAD_REQUEST, {"error": "not a push payload"}
+        if not default_branch(payload):
+            return HTTPStatus.ACCEPTED, {"ignored": payload.get("ref")}
+        found = matching(self.targets, payload)
+        for targetCF in found:
+            self.schedule(targetCF)
+        log.info(f"Webhook Push| {len(found)} Target(s) Matched")
+        return HTTPStatus.ACCEPTED, {
+            "targets": [targetCF.targetDirectory for targetCF in found]
+        }